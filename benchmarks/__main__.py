@@ -0,0 +1,46 @@
+import argparse
+import json
+import sys
+
+from benchmarks.suite import CASES, compare, run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Time the hot paths and write the results as JSON.')
+    parser.add_argument('--out', default=None,
+                        help='JSON file for the results (default: stdout)')
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='case to run, may be repeated (default: all)')
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller problem sizes')
+    parser.add_argument('--compare', default=None, metavar='JSON',
+                        help='results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    def progress(r):
+        value = 'skipped' if r['value'] is None else '%.4g' % r['value']
+        sys.stderr.write('%-12s %-32s %12s %s\n' % (
+            r['case'], r['name'], value, r['unit']))
+
+    results = run(args.case, args.quick, progress)
+    if args.out is None:
+        json.dump(results, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare is not None:
+        # on stderr like the progress, stdout may hold the JSON
+        with open(args.compare) as f:
+            old = json.load(f)
+        lines = ['%-12s %-32s %12s %12s %9s %s' % ('case', 'name', 'new', 'old',
+                                                   'ratio', 'unit')]
+        lines.extend(compare(results, old))
+        sys.stderr.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Import-time budget: the numerical core must load with NumPy only, and the
+# plotting modules, the CLI and the GUI module must not pull in matplotlib,
+# Pillow or tqdm before they are used. Exits non-zero when a module imports
+# a forbidden package or needs longer than its budget on top of NumPy.
+#
+#   python -m benchmarks.importtime [--repeat 5] [--scale 1.0]
+#
+# tests/test_importtime.py checks the forbidden packages on every run and
+# the budgets when DIRACGAN_IMPORTTIME_SCALE is set.
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ('matplotlib', 'PIL', 'tqdm', 'tkinter')
+
+# module: (milliseconds on top of NumPy, packages it must not import)
+BUDGETS = {
+    'diracgan': (30, HEAVY),
+    'diracgan.gans': (30, HEAVY),
+    'diracgan.simulate': (30, HEAVY),
+    'diracgan.util': (30, HEAVY),
+    'diracgan.cache': (40, HEAVY),
+    'diracgan.plotting': (80, HEAVY),
+    'diracgan.subplots': (30, HEAVY),
+    'diracgan.__main__': (100, HEAVY),
+    'dirac_gui': (120, ('matplotlib', 'PIL', 'tqdm')),
+}
+
+
+def importtime(module):
+    # {name: cumulative microseconds} and the top-level total of one fresh
+    # interpreter importing module
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          'import ' + module],
+                         env=env, cwd=ROOT, capture_output=True, text=True,
+                         check=True).stderr
+    times = {}
+    total = 0
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative = int(cumulative)
+        times.setdefault(name.strip(), cumulative)
+        if not name[1:].startswith(' '):
+            total += cumulative
+    return times, total
+
+
+def measure(module, repeat=5):
+    # Best of repeat runs of the import time without NumPy, in ms, and the
+    # set of imported top-level packages
+    best = None
+    for _ in range(repeat):
+        times, total = importtime(module)
+        own = (total - times.get('numpy', 0)) / 1000.
+        best = own if best is None else min(best, own)
+    packages = set(name.split('.')[0] for name in times)
+    return best, packages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.importtime')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='multiplies every budget, for slow machines')
+    args = parser.parse_args(argv)
+
+    failed = False
+    print('%-20s %10s %10s  %s' % ('module', 'ms', 'budget', 'status'))
+    for module, (budget, forbidden) in BUDGETS.items():
+        ms, packages = measure(module, args.repeat)
+        budget *= args.scale
+        bad = sorted(packages.intersection(forbidden))
+        status = 'ok'
+        if bad:
+            status = 'imports ' + ', '.join(bad)
+        elif ms > budget:
+            status = 'over budget'
+        failed |= status != 'ok'
+        print('%-20s %10.1f %10.1f  %s' % (module, ms, budget, status))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
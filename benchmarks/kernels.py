@@ -0,0 +1,35 @@
+# Vector field kernels on 1e6-point inputs, allocating the result on every
+# call against writing into preallocated out= buffers.
+#
+#   python -m benchmarks.kernels
+import timeit
+
+import numpy as np
+
+from diracgan.presets import make_gans
+
+
+# the GUI's GANs with their default parameters
+GANS = make_gans()
+
+
+def best_of(fn, number=3, repeat=5):
+    return min(timeit.Timer(fn).repeat(repeat, number)) / number
+
+
+def main(n=10**6):
+    rng = np.random.default_rng(0)
+    theta = rng.uniform(-2, 2, n)
+    psi = rng.uniform(-2, 2, n)
+    out = np.empty(n), np.empty(n)
+
+    print('%-20s %12s %12s' % ('class', 'alloc [ms]', 'out= [ms]'))
+    for vec_fn in GANS:
+        t_alloc = best_of(lambda: vec_fn._get_vector(theta, psi))
+        t_out = best_of(lambda: vec_fn._get_vector(theta, psi, out=out))
+        print('%-20s %12.2f %12.2f' % (
+            vec_fn.__class__.__name__, 1e3*t_alloc, 1e3*t_out))
+
+
+if __name__ == '__main__':
+    main()
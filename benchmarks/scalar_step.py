@@ -0,0 +1,46 @@
+# Per-step cost of scalar integration: the scalar fast path against the
+# array kernels wrapped in 1-element arrays, as VectorField used to do.
+#
+#   python -m benchmarks.scalar_step
+import timeit
+
+import numpy as np
+
+from diracgan.presets import make_gans
+
+
+# the GUI's GANs with their default parameters
+GANS = make_gans()
+
+
+def array_step(vec_fn, theta, psi, h=0.1):
+    v1, v2 = vec_fn._get_vector(np.array([theta]), np.array([psi]))
+    theta += h * v1[0]
+    psi += h * v2[0]
+    theta, psi = vec_fn._postprocess(np.array([theta]), np.array([psi]))
+    return theta[0], psi[0]
+
+
+def scalar_step(vec_fn, theta, psi, h=0.1):
+    v1, v2 = vec_fn(theta, psi)
+    theta += h * v1
+    psi += h * v2
+    return vec_fn.postprocess(theta, psi)
+
+
+def per_step(step, vec_fn, number=2000, repeat=5):
+    timer = timeit.Timer(lambda: step(vec_fn, 0.5, 0.5))
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main():
+    print('%-20s %12s %12s %8s' % ('class', 'array [us]', 'scalar [us]', 'speedup'))
+    for vec_fn in GANS:
+        t_array = per_step(array_step, vec_fn)
+        t_scalar = per_step(scalar_step, vec_fn)
+        print('%-20s %12.2f %12.2f %7.1fx' % (
+            vec_fn.__class__.__name__, 1e6*t_array, 1e6*t_scalar, t_array/t_scalar))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Benchmark suite over the hot paths, written as JSON so that runs on
+# different commits can be compared:
+#
+#   python -m benchmarks --out before.json
+#   git checkout ...
+#   python -m benchmarks --out after.json --compare before.json
+#
+# Every case yields records {'case', 'name', 'value', 'unit'}. Times are
+# the best of several repeats. The GUI case needs a display for Tk and is
+# recorded as skipped without one.
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+from diracgan.gans import GAN_InstNoise
+from diracgan.presets import make_gans
+from diracgan.simulate import trajectory_simgd, trajectory_altgd
+
+
+def best_of(fn, number=1, repeat=5):
+    return min(timeit.Timer(fn).repeat(repeat, number)) / number
+
+
+def record(case, name, value, unit):
+    return {'case': case, 'name': name, 'value': value, 'unit': unit}
+
+
+def bench_integrators(quick=False):
+    # Per-step cost of the scalar integrators for every GAN of the GUI
+    nsteps = 200 if quick else 2000
+    for gan in make_gans():
+        name = gan.__class__.__name__
+        t = best_of(lambda: trajectory_simgd(gan, 1., 1., nsteps=nsteps))
+        yield record('integrators', 'simgd/' + name, 1e6 * t / nsteps, 'us/step')
+        t = best_of(lambda: trajectory_altgd(gan, 1., 1., nsteps=nsteps))
+        yield record('integrators', 'altgd/' + name, 1e6 * t / nsteps, 'us/step')
+
+
+def bench_vector_grid(quick=False):
+    # _get_vector on n x n grids into preallocated buffers. GAN_InstNoise
+    # evaluates its expectation per point and has its own case.
+    sizes = (10, 100) if quick else (10, 100, 1000)
+    for n in sizes:
+        theta, psi = np.meshgrid(np.linspace(-2, 2, n), np.linspace(-2, 2, n))
+        out = np.empty_like(theta), np.empty_like(theta)
+        for gan in make_gans():
+            if isinstance(gan, GAN_InstNoise):
+                continue
+            t = best_of(lambda: gan._get_vector(theta, psi, out=out),
+                        number=max(1, 10**6 // n**2))
+            yield record('vector_grid', '%s/%d^2' % (gan.__class__.__name__, n),
+                         1e3 * t, 'ms')
+
+
+def bench_instnoise(quick=False):
+    # Instance noise by quadrature and by Monte-Carlo, per grid and per
+    # integration step
+    nsteps = 100 if quick else 500
+    sizes = (10, 100) if quick else (10, 100, 300)
+    for method in ('quadrature', 'mc'):
+        gan = GAN_InstNoise(0.7, method=method, seed=0)
+        # Monte-Carlo draws nsamples per point, 300^2 would take minutes
+        for n in sizes if method == 'quadrature' else sizes[:2]:
+            theta, psi = np.meshgrid(np.linspace(-2, 2, n), np.linspace(-2, 2, n))
+            t = best_of(lambda: gan._get_vector(theta, psi), repeat=3)
+            yield record('instnoise', '%s/%d^2' % (method, n), 1e3 * t, 'ms')
+        t = best_of(lambda: trajectory_simgd(gan, 1., 1., nsteps=nsteps),
+                    repeat=3)
+        yield record('instnoise', '%s/simgd' % method, 1e6 * t / nsteps,
+                     'us/step')
+
+
+def bench_rendering(quick=False):
+    # Frames per second of plotting.simulate_trajectories writing a GIF,
+    # with one process and with the default pool
+    import matplotlib
+    matplotlib.use('Agg')
+    from diracgan.plotting import simulate_trajectories
+
+    gan = make_gans()[0]
+    frames = 50 if quick else 300
+    trajectory = trajectory_simgd(gan, 1., 1., nsteps=frames)
+    theta = np.linspace(-2, 2, 10)
+    with tempfile.TemporaryDirectory() as folder:
+        outfile = os.path.join(folder, 'frames.gif')
+        for workers in (1, None):
+            start = time.perf_counter()
+            simulate_trajectories(gan, theta, theta,
+                                  (trajectory.thetas, trajectory.psis),
+                                  outfile, maxframes=frames, workers=workers)
+            t = time.perf_counter() - start
+            name = 'gif/workers=%s' % ('1' if workers == 1 else 'all')
+            yield record('rendering', name, (frames - 1) / t, 'frames/s')
+
+
+def bench_gui(quick=False):
+    # DiracGANPlot.init_plot_values followed by update_plot and a full
+    # draw of the Tk/Agg canvas, with an empty cache (trajectories come from
+    # the pool) and again with every trajectory cached
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        yield record('gui', 'skipped', None, str(e))
+        return
+    root.withdraw()
+    import dirac_gui
+    from diracgan.cache import TrajectoryCache
+
+    app = dirac_gui.DiracGANPlot(root)
+    try:
+        app.n_steps.set(100 if quick else 500)
+        for name in ('cold', 'warm'):
+            if name == 'cold':
+                app.cache = TrajectoryCache()
+            start = time.perf_counter()
+            app.init_plot_values()
+            while app.jobs:
+                root.update()
+                time.sleep(0.001)
+            app.update_plot()
+            app.canvas.draw()
+            root.update()
+            t = time.perf_counter() - start
+            yield record('gui', 'init+update/' + name, 1e3 * t, 'ms')
+        t = best_of(lambda: (app.update_plot(), root.update()), number=10)
+        yield record('gui', 'update_plot/unchanged', 1e3 * t, 'ms')
+        t = best_of(app.canvas.draw, repeat=3)
+        yield record('gui', 'canvas.draw', 1e3 * t, 'ms')
+    finally:
+        # also destroys root
+        app.close()
+
+
+CASES = {
+    'integrators': bench_integrators,
+    'vector_grid': bench_vector_grid,
+    'instnoise': bench_instnoise,
+    'rendering': bench_rendering,
+    'gui': bench_gui,
+}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run(cases=None, quick=False, progress=None):
+    results = []
+    for case in cases or CASES:
+        for result in CASES[case](quick):
+            if progress is not None:
+                progress(result)
+            results.append(result)
+    return {'meta': metadata(), 'results': results}
+
+
+def compare(new, old):
+    # Lines of 'case name new old ratio' for records present in both runs
+    before = {(r['case'], r['name']): r['value'] for r in old['results']}
+    lines = []
+    for r in new['results']:
+        value = before.get((r['case'], r['name']))
+        if value is None or r['value'] is None:
+            continue
+        lines.append('%-12s %-32s %12.4g %12.4g %8.2fx %s' % (
+            r['case'], r['name'], r['value'], value, r['value'] / value,
+            r['unit']))
+    return lines
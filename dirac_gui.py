@@ -1,24 +1,18 @@
+import multiprocessing
+import os
+import time
 import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor
 from tkinter import ttk
 
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-from diracgan.gans import (
-    GAN,
-    NSGAN,
-    WGAN,
-    WGAN_GP,
-    GAN_Consensus,
-    GAN_GradPenalty,
-    GAN_InstNoise,
-    NSGAN_GradPenalty,
-)
-
-from new_gans import LSGAN, LeCamGAN
-
-from diracgan.simulate import trajectory_altgd, trajectory_simgd
+from diracgan import instrument
+from diracgan.cache import TrajectoryCache
+from diracgan.decimate import decimate_view
+from diracgan.fieldgrid import missing_tiles, view_field
+from diracgan.presets import DEFAULT_PARAMS, make_gans
+from diracgan.simulate import TrajectoryStream, trajectory_gd
 
 # ablauf:
 """
@@ -35,29 +29,8 @@ class DiracGANPlot:
         # plot configs
         # gan configs
 
-        self.GAN_params = {
-            "WGAN_clip": 1.0,
-            "WGAN_GP_reg": 0.7,
-            "WGAN_GP_target": 1.0,
-            "GAN_InstNoise_std": 0.7,
-            "GAN_GradPenalty_reg": 0.3,
-            "GAN_Consensus_reg": 1.0,
-            "NSGAN_GradPenalty_reg": 0.3,
-            "LeCamGAN_lambda": -0.3,  # default value for LeCamGAN
-            "LeCamGAN_alpha":0.1
-        }
-        self.GANS = [
-            GAN(),
-            NSGAN(),
-            WGAN(self.GAN_params["WGAN_clip"]),
-            WGAN_GP(self.GAN_params["WGAN_GP_reg"], self.GAN_params["WGAN_GP_target"]),
-            GAN_InstNoise(self.GAN_params["GAN_InstNoise_std"]),
-            GAN_GradPenalty(self.GAN_params["GAN_GradPenalty_reg"]),
-            GAN_Consensus(self.GAN_params["GAN_Consensus_reg"]),
-            NSGAN_GradPenalty(self.GAN_params["NSGAN_GradPenalty_reg"]),
-            LSGAN(),
-            LeCamGAN(self.GAN_params["LeCamGAN_lambda"], self.GAN_params["LeCamGAN_alpha"])
-        ]
+        self.GAN_params = dict(DEFAULT_PARAMS)
+        self.GANS = make_gans(self.GAN_params)
 
         # learning rate
         self.h_d = tk.DoubleVar(value=0.2)
@@ -73,10 +46,61 @@ class DiracGANPlot:
 
         self.theta_s = np.linspace(-2, 2.0, 10)
         self.psi_s = np.linspace(-2, 2, 10)
+        # after zooming or panning, the arrows of the new view are evaluated
+        # for up to field_budget seconds per Tk callback
+        self.field_pending = False
+        self.field_budget = 0.02
 
         # what kind of gradient descent (simultaneous or alternating)
         self.grad_descent = "simultaneous"
 
+        # trajectories and arrows of configurations computed before
+        self.cache = TrajectoryCache()
+
+        # trajectories are simulated in worker processes, one job per GAN;
+        # results are collected by polling from the Tk main loop
+        self.executor = ProcessPoolExecutor(
+            max_workers=min(len(self.GANS), os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.jobs = {}
+        self.generation = 0
+        self.poll_interval = 20
+        self.status_interval = 1000
+
+        # with live preview, preview_delay ms after the last slider change
+        # the first preview_steps steps are simulated right away and the
+        # rest in the background
+        self.live_preview = tk.BooleanVar(value=True)
+        self.preview_delay = 50
+        self.preview_steps = 50
+        self.preview_after = None
+
+        # animation artists per subplot and frame timing
+        self.trails = [None] * len(self.GANS)
+        self.heads = [None] * len(self.GANS)
+        self.anim_marker = dict(
+            marker="^", markerfacecolor="none", markeredgecolor="#5e81ac", alpha=0.8
+        )
+        self.frame_interval = 10
+        self.last_frame = None
+        # Tk id of the scheduled animate_step, None while none is pending
+        self.animate_after = None
+        # frames start from the image of the last full redraw, which shows
+        # the trails up to trail_steps; after redraw_interval more steps the
+        # trails are brought up to date by another full redraw
+        self.backgrounds = None
+        self.trail_steps = [0] * len(self.GANS)
+        self.redraw_interval = 100
+        # animations simulate as they play and keep the last trail_length
+        # points of every trajectory
+        self.streams = None
+        self.stream_generation = None
+        self.trail_length = 1000
+        self.index = 0
+        self.frame_cost = None
+        self.frame_period = None
+
         self.root = root
 
         screen_width = root.winfo_screenwidth()
@@ -86,12 +110,19 @@ class DiracGANPlot:
         root.geometry(f"{screen_width}x{screen_height}")
 
         self.root.title("DiracGAN Convergence Plotter")
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
         # Create a frame for the plot
         self.plot_frame = ttk.Frame(root)
         self.plot_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
 
-        # Create a matplotlib figure
+        # Create a matplotlib figure. matplotlib is imported here rather than
+        # at the top so that the window is up before it loads, and so that
+        # the spawned simulation workers, which import this module, never
+        # load it.
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         n_cols = len(self.GANS) // 2
         self.fig, self.axs = plt.subplots(
             2,
@@ -104,6 +135,11 @@ class DiracGANPlot:
         self.axs = self.axs.flatten()
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.plot_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.canvas.mpl_connect("resize_event", self.on_resize)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        if instrument.enabled:
+            # every render of the figure, also those of draw_idle
+            self.canvas.draw = instrument.timed("draw", self.canvas.draw)
 
         # ---------- SLIDER ----------------
         self.start_theta_slider = tk.Scale(
@@ -114,6 +150,7 @@ class DiracGANPlot:
             label="Start Theta",
             resolution=0.01,
             variable=self.theta0,
+            command=self.slider_changed,
             length=100
         )
         self.start_theta_slider.pack(fill="x", expand=False)
@@ -125,6 +162,7 @@ class DiracGANPlot:
             orient=tk.HORIZONTAL,
             label="Start Psi",
             variable=self.psi0,
+            command=self.slider_changed,
             resolution=0.01,
         )
         self.start_psi_slider.pack(fill="x", expand=True)
@@ -136,6 +174,7 @@ class DiracGANPlot:
             orient=tk.HORIZONTAL,
             label="Number of Steps",
             variable=self.n_steps,
+            command=self.slider_changed,
         )
         self.num_steps_slider.pack(fill="x", expand=True)
 
@@ -146,6 +185,7 @@ class DiracGANPlot:
             orient=tk.HORIZONTAL,
             label="Generator Learning Rate",
             variable=self.h_g,
+            command=self.slider_changed,
             resolution=0.01,
         )
         self.h_g_slider.pack(fill="x", expand=True)
@@ -157,6 +197,7 @@ class DiracGANPlot:
             orient=tk.HORIZONTAL,
             label="Discriminator Learning Rate",
             variable=self.h_d,
+            command=self.slider_changed,
             resolution=0.01,
         )
         self.h_d_slider.pack(fill="x", expand=True)
@@ -168,6 +209,7 @@ class DiracGANPlot:
             orient=tk.HORIZONTAL,
             label="Discriminator Updates per Generator Update",
             variable=self.dsteps,
+            command=self.slider_changed,
         )
         self.dsteps_slider.pack(fill="x", expand=True)
 
@@ -178,6 +220,7 @@ class DiracGANPlot:
             orient=tk.HORIZONTAL,
             label="Generator Updates per Discriminator Update",
             variable=self.gsteps,
+            command=self.slider_changed,
         )
         self.gsteps_slider.pack(fill="x", expand=True)
 
@@ -200,6 +243,17 @@ class DiracGANPlot:
         # Button to update the plot
         self.apply_button = ttk.Button(root, text="Apply", command=self.apply_changes)
         self.apply_button.pack(side=tk.LEFT, padx=6, pady=5)
+        self.preview_checkbox = ttk.Checkbutton(
+            root, text="Live preview", variable=self.live_preview
+        )
+        self.preview_checkbox.pack(side=tk.LEFT, padx=6, pady=5)
+        self.frame_label = ttk.Label(root, text="", width=32)
+        self.frame_label.pack(side=tk.LEFT, padx=6, pady=5)
+        # counts and timings of diracgan.instrument, when enabled
+        self.status_label = ttk.Label(root, text="")
+        if instrument.enabled:
+            self.status_label.pack(side=tk.LEFT, padx=6, pady=5)
+            self.root.after(self.status_interval, self.update_status)
         self.toggle_button = ttk.Button(
             root,
             text="Start Trajectory",
@@ -271,6 +325,7 @@ class DiracGANPlot:
         # self.grad_descent_combobox.set("simultaneous")
 
         # Initial plot
+        self.setup_axes()
         self.refresh_plot()
         self.update_plot()
 
@@ -372,110 +427,325 @@ class DiracGANPlot:
         self.update_plot()
 
     def refresh_plot(self):
-        self.GANS = [
-            GAN(),
-            NSGAN(),
-            WGAN(self.GAN_params["WGAN_clip"]),
-            WGAN_GP(self.GAN_params["WGAN_GP_reg"], self.GAN_params["WGAN_GP_target"]),
-            GAN_InstNoise(self.GAN_params["GAN_InstNoise_std"]),
-            GAN_GradPenalty(self.GAN_params["GAN_GradPenalty_reg"]),
-            GAN_Consensus(self.GAN_params["GAN_Consensus_reg"]),
-            NSGAN_GradPenalty(self.GAN_params["NSGAN_GradPenalty_reg"]),
-            LSGAN(),
-            LeCamGAN(self.GAN_params["LeCamGAN_lambda"], self.GAN_params["LeCamGAN_alpha"])
-        ]
+        self.GANS = make_gans(self.GAN_params)
         self.init_plot_values()
         self.step = 0
-        for ax in self.axs:
-            ax.clear()
 
-    def init_plot_values(self):
-        self.trajectories = []
+    def slider_changed(self, value=None):
+        # Tk calls this for every step of a drag, only the last one counts
+        if not self.live_preview.get():
+            return
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(self.preview_delay, self.preview)
+
+    def preview(self):
+        # A running animation restarts its streams from the new parameters
+        # in its next frame
+        self.preview_after = None
+        if self.animate_after is not None:
+            self.init_plot_values()
+        else:
+            self.init_plot_values(preview_steps=self.preview_steps)
+            self.update_plot()
+
+    def init_plot_values(self, preview_steps=None):
+        # Trajectories are taken from the cache where possible and simulated
+        # in the background otherwise; until then their entry is None. With
+        # preview_steps, missing trajectories are first simulated that far
+        # here, or as far as cached, and the background job extends them.
+        self.cancel_jobs()
+        self.trajectories = [None] * len(self.GANS)
         self.arrows = []
+        self.grids = []
+        xlim, ylim = self.axs[0].get_xlim(), self.axs[0].get_ylim()
+
+        theta0, psi0 = self.theta0.get(), self.psi0.get()
+        h_g, h_d = self.h_g.get(), self.h_d.get()
+        nsteps = self.n_steps.get()
+        gsteps, dsteps = self.gsteps.get(), self.dsteps.get()
+
+        for i, gan in enumerate(self.GANS):
+            # arrows on the grid matching the current view
+            with instrument.stage("grid"):
+                theta, psi, v1, v2 = view_field(self.cache, gan, xlim, ylim)
+            self.grids.append((theta, psi))
+            self.arrows.append((v1, v2))
 
-        for gan in self.GANS:
-            if self.grad_descent == "simultaneous":
-                self.trajectories.append(
-                    trajectory_simgd(
-                        gan,
-                        self.theta0.get(),
-                        self.psi0.get(),
-                        nsteps=self.n_steps.get(),
-                        hs_d=self.h_d.get(),
-                        hs_g=self.h_g.get(),
-                    )
-                )
-            else:  # alternating mode
-                self.trajectories.append(
-                    trajectory_altgd(
-                        gan,
-                        self.theta0.get(),
-                        self.psi0.get(),
-                        nsteps=self.n_steps.get(),
-                        hs_d=self.h_d.get(),
-                        hs_g=self.h_g.get(),
-                        gsteps=self.gsteps.get(),
-                        dsteps=self.dsteps.get(),
+            key = self.cache.trajectory_key(
+                gan, theta0, psi0, h_g, h_d, self.grad_descent, gsteps, dsteps
+            )
+            resume = None
+            if key is not None:
+                self.trajectories[i] = self.cache.get_trajectory(key, nsteps)
+                resume = self.cache.stored_trajectory(key)
+            if self.trajectories[i] is not None:
+                continue
+            if preview_steps:
+                n = min(preview_steps, nsteps)
+                if resume is not None:
+                    n = max(n, resume.nsteps)
+                with instrument.stage("integration"):
+                    self.trajectories[i] = self.cache.trajectory(
+                        gan, theta0, psi0, nsteps=n, hs_g=h_g, hs_d=h_d,
+                        scheme=self.grad_descent, gsteps=gsteps, dsteps=dsteps,
                     )
-                )
+                if n == nsteps:
+                    continue
+                if key is not None:
+                    resume = self.cache.stored_trajectory(key)
+            future = instrument.submit(
+                self.executor,
+                "integration",
+                trajectory_gd,
+                gan,
+                theta0,
+                psi0,
+                nsteps=nsteps,
+                hs_d=h_d,
+                hs_g=h_g,
+                scheme=self.grad_descent,
+                gsteps=gsteps,
+                dsteps=dsteps,
+                resume=resume,
+            )
+            self.jobs[i] = (future, key, nsteps)
 
-            theta_mesh, psi_mesh = np.meshgrid(self.theta_s, self.psi_s)
-            # directions for the arrows
-            v1, v2 = gan(theta_mesh, psi_mesh)
-            self.arrows.append((v1, v2))
+        if self.jobs:
+            self.root.after(self.poll_interval, self.poll_jobs, self.generation)
 
-    def update_plot(self):
-        # Generate grid and vector field data
+    def cancel_jobs(self):
+        # Results of older parameter sets are dropped when they arrive
+        self.generation += 1
+        for future, key, nsteps in self.jobs.values():
+            future.cancel()
+        self.jobs = {}
+
+    def poll_jobs(self, generation):
+        if generation != self.generation:
+            return
+
+        for i, (future, key, nsteps) in list(self.jobs.items()):
+            if not future.done():
+                continue
+            del self.jobs[i]
+            try:
+                trajectory = future.result()
+            except Exception as e:
+                print(f"Simulating {self.GANS[i].__class__.__name__} failed: {e}")
+                continue
+            if key is not None:
+                self.cache.put_trajectory(key, trajectory)
+                trajectory = self.cache.get_trajectory(key, nsteps, count=False)
+            # results arriving during an animation are drawn when it stops
+            self.trajectories[i] = trajectory
+            if not self.animating and self.update_panel(i):
+                self.canvas.draw_idle()
+
+        if self.jobs:
+            self.root.after(self.poll_interval, self.poll_jobs, generation)
+
+    def update_status(self):
+        self.status_label.config(text=instrument.summary())
+        self.root.after(self.status_interval, self.update_status)
+
+    def close(self):
+        self.cancel_jobs()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    def setup_axes(self):
+        # Artists are created once and then only get new data
+        self.quivers = []
+        self.quiver_grids = []
+        self.paths = []
+        self.starts = []
+        self.shown = [None] * len(self.axs)
+        X, Y = np.meshgrid(self.theta_s, self.psi_s)
         for i, ax in enumerate(self.axs):
             ax.set_xlim(self.theta_s.min() - 0.25, self.theta_s.max() + 0.25)
             ax.set_ylim(self.psi_s.min() - 0.25, self.psi_s.max() + 0.25)
             ax.set_xticks([-2, -1, 0, 1, 2])
             ax.set_yticks([-2, -1, 0, 1, 2])
-            x = self.theta_s
-            y = self.psi_s
-            X, Y = np.meshgrid(x, y)
-            U = self.arrows[i][0]
-            V = self.arrows[i][1]
-
-            # Plot the quiver
-            ax.quiver(X, Y, U, V, color="#3b4252")
             ax.set_title(self.GANS[i].__class__.__name__)
             ax.set_aspect("equal")
 
-            psis, thetas = self.trajectories[i]
-            ax.scatter(
-                psis,
-                thetas,
-                marker="^",
-                facecolor="None",
-                edgecolor="#5e81ac",
-                alpha=0.8,
+            self.quivers.append(
+                ax.quiver(
+                    X, Y, np.zeros_like(X), np.zeros_like(Y), color="#3b4252", zorder=0.9
+                )
+            )
+            self.quiver_grids.append((self.theta_s, self.psi_s))
+            self.paths.append(
+                ax.scatter(
+                    [],
+                    [],
+                    marker="^",
+                    facecolor="None",
+                    edgecolor="#5e81ac",
+                    alpha=0.8,
+                )
+            )
+            self.starts.append(ax.scatter([], [], color="#bf616a"))
+            # zooming and panning change the points worth drawing
+            for limits in ("xlim_changed", "ylim_changed"):
+                ax.callbacks.connect(limits, lambda ax, i=i: self.update_path(i))
+                if i == 0:
+                    # the panels share their view
+                    ax.callbacks.connect(limits, self.view_changed)
+
+            # the trail holds the points shown up to the last full redraw,
+            # frames blit the points after it on top of that image
+            (self.trails[i],) = ax.plot(
+                [], [], linestyle="none", **self.anim_marker
+            )
+            (self.heads[i],) = ax.plot(
+                [], [], linestyle="none", animated=True, **self.anim_marker
             )
-            ax.scatter(psis[0], thetas[0], color="#bf616a")
 
-            self.canvas.draw()
+    def update_plot(self):
+        with instrument.stage("artists"):
+            changed = [self.update_panel(i) for i in range(len(self.axs))]
+        if any(changed):
+            self.canvas.draw_idle()
+
+    def update_panel(self, i, path=True):
+        # Updates the artists of subplot i, returns whether anything changed
+        trajectory = self.trajectories[i]
+        if trajectory is None:
+            data = np.empty((0, 2))
+        else:
+            data = trajectory.data
+        U, V = self.arrows[i]
+        # the arrays themselves are kept so their memory cannot be reused
+        shown = (U, V, data, path)
+        last = self.shown[i]
+        if (
+            last is not None
+            and last[0] is U
+            and last[1] is V
+            and np.shares_memory(last[2][:1], data[:1])
+            and last[2].shape == data.shape
+            and last[3] == path
+        ):
+            return False
+        self.shown[i] = shown
+
+        self.set_quiver(i)
+        self.update_path(i)
+        self.starts[i].set_offsets(data[:1])
+        if not self.animating:
+            self.trails[i].set_data([], [])
+        return True
+
+    def set_quiver(self, i):
+        # A new grid needs a new quiver, set_UVC only takes new arrows
+        theta, psi = self.grids[i]
+        U, V = self.arrows[i]
+        last_theta, last_psi = self.quiver_grids[i]
+        if not (
+            theta.shape == last_theta.shape
+            and psi.shape == last_psi.shape
+            and np.allclose(theta, last_theta)
+            and np.allclose(psi, last_psi)
+        ):
+            self.quivers[i].remove()
+            X, Y = np.meshgrid(theta, psi)
+            self.quivers[i] = self.axs[i].quiver(X, Y, U, V, color="#3b4252", zorder=0.9)
+            self.quiver_grids[i] = (theta, psi)
+        else:
+            self.quivers[i].set_UVC(U, V)
+
+    def view_changed(self, ax=None):
+        if not self.field_pending:
+            self.field_pending = True
+            self.root.after(1, self.refine_fields)
+
+    def refine_fields(self):
+        # Evaluates the missing tiles of the view's grid in chunks, so that
+        # the UI stays responsive while zooming, then shows the new arrows.
+        # A view that changes in between is picked up by the next call.
+        self.field_pending = False
+        xlim, ylim = self.axs[0].get_xlim(), self.axs[0].get_ylim()
+        start = time.perf_counter()
+        with instrument.stage("grid"):
+            for gan in self.GANS:
+                for tile in missing_tiles(self.cache, gan, xlim, ylim):
+                    if time.perf_counter() - start > self.field_budget:
+                        self.view_changed()
+                        return
+                    self.cache.field_tile(gan, *tile)
+
+        changed = False
+        for i, gan in enumerate(self.GANS):
+            theta, psi, v1, v2 = view_field(self.cache, gan, xlim, ylim)
+            self.grids[i] = (theta, psi)
+            self.arrows[i] = (v1, v2)
+            changed |= self.update_panel(i, path=not self.animating)
+        if changed:
+            self.canvas.draw_idle()
+
+    def update_path(self, i):
+        # The scatter shows the visible part of the trajectory reduced to
+        # about two points per pixel of the panel's width
+        if self.shown[i] is None:
+            return
+        U, V, data, path = self.shown[i]
+        ax = self.axs[i]
+        self.paths[i].set_offsets(decimate_view(data, ax) if path else data[:0])
+
+    def on_resize(self, event):
+        for i in range(len(self.axs)):
+            self.update_path(i)
+
+    def on_draw(self, event):
+        # Animated artists are left out of full redraws, the result is the
+        # background of the following frames
+        if self.animating:
+            self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axs]
+        else:
+            self.backgrounds = None
 
-    def make_initial_plot(self):
+    def update_trails(self):
         for i, ax in enumerate(self.axs):
-            ax.set_xlim(self.theta_s.min() - 0.25, self.theta_s.max() + 0.25)
-            ax.set_ylim(self.psi_s.min() - 0.25, self.psi_s.max() + 0.25)
-            ax.set_xticks([-2, -1, 0, 1, 2])
-            ax.set_yticks([-2, -1, 0, 1, 2])
-            x = self.theta_s
-            y = self.psi_s
-            X, Y = np.meshgrid(x, y)
-            U = self.arrows[i][0]
-            V = self.arrows[i][1]
-
-            # Plot the quiver
-            ax.quiver(X, Y, U, V, color="#3b4252")
-            ax.set_title(self.GANS[i].__class__.__name__)
-            ax.set_aspect("equal")
+            stream = self.streams[i]
+            trail = decimate_view(stream.recent(), ax, method="minmax")
+            self.trails[i].set_data(trail[:, 0], trail[:, 1])
+            self.trail_steps[i] = stream.step
 
-            psis, thetas = self.trajectories[i]
-            ax.scatter(psis[0], thetas[0], color="#bf616a")
+    def make_initial_plot(self):
+        # Animations start from the start points only
+        for i in range(len(self.axs)):
+            self.update_panel(i, path=False)
+            self.starts[i].set_offsets(self.streams[i].recent()[:1])
+        self.update_trails()
+        self.canvas.draw()
 
-            self.canvas.draw()
+    def make_streams(self, skip=0):
+        # The animation integrates its own trajectories only as far as it
+        # has played, the pool's results are for the static plot. With skip,
+        # the new trajectories are advanced to that step.
+        theta0, psi0 = self.theta0.get(), self.psi0.get()
+        self.streams = [
+            TrajectoryStream(
+                gan,
+                theta0,
+                psi0,
+                hs_g=self.h_g.get(),
+                hs_d=self.h_d.get(),
+                scheme=self.grad_descent,
+                gsteps=self.gsteps.get(),
+                dsteps=self.dsteps.get(),
+                nsteps=self.n_steps.get(),
+                history=self.trail_length,
+            )
+            for gan in self.GANS
+        ]
+        for stream in self.streams:
+            stream.take(skip)
+        self.stream_generation = self.generation
+        # the trails show the old trajectories
+        self.backgrounds = None
 
     def start_animation(self):
         if not self.animating:
@@ -483,43 +753,100 @@ class DiracGANPlot:
             self.index = 0
 
             self.refresh_plot()
-            self.make_initial_plot()
-            self.animate_step()
+            self.make_streams()
+            self.begin_animation()
+
+    def begin_animation(self):
+        if not self.animating:
+            return
+        self.make_initial_plot()
+        self.last_frame = None
+        self.animate_step()
 
     def continue_animation(self):
         if not self.animating:
             self.animating = True
-            # self.index = 0
-
-            # self.refresh_plot()
-            # self.make_initial_plot()
+            self.last_frame = None
+            # back from the static plot to the start points and trails
+            for i in range(len(self.axs)):
+                self.update_panel(i, path=False)
+            self.backgrounds = None
             self.animate_step()
 
     def stop_animation(self):
+        # The static plot takes over, with the trajectories that finished
+        # in the meantime
+        if not self.animating:
+            return
         self.animating = False
-        # if self.after_id is not None:
-        #    self.root.after_cancel(self.after_id)
-        #    self.after_id = None
+        if self.animate_after is not None:
+            self.root.after_cancel(self.animate_after)
+            self.animate_after = None
+        self.update_plot()
 
     def animate_step(self):
-        if not self.animating or self.index >= len(self.trajectories[0][0]):
+        self.animate_after = None
+        if not self.animating:
+            return
+        if self.streams is None or self.stream_generation != self.generation:
+            # parameters changed while animating, the new trajectories
+            # continue from the current step
+            self.make_streams(skip=self.index)
+
+        start = time.perf_counter()
+        k = self.index
+        for stream in self.streams:
+            if k > stream.step:
+                stream.take(k - stream.step)
+        if all(k > stream.step for stream in self.streams):
+            # every trajectory has ended
+            self.stop_animation()
             return
-        for i, ax in enumerate(self.axs):
-            psis, thetas = self.trajectories[i]
-            ax.scatter(
-                psis[self.index],
-                thetas[self.index],
-                marker="^",
-                facecolors="none",
-                edgecolors="#5e81ac",
-                alpha=0.8,
-            )
 
-        self.canvas.draw()
+        if self.backgrounds is None or any(
+            stream.step - step > self.redraw_interval
+            for stream, step in zip(self.streams, self.trail_steps)
+        ):
+            self.update_trails()
+            self.canvas.draw()
+
+        for i, ax in enumerate(self.axs):
+            # the points after the trail, trajectories that stopped early
+            # stay at their last point
+            stream = self.streams[i]
+            recent = stream.recent()
+            n = stream.step - self.trail_steps[i]
+            new = recent[max(0, len(recent) - n - 1):]
+            self.canvas.restore_region(self.backgrounds[i])
+            self.heads[i].set_data(new[:, 0], new[:, 1])
+            ax.draw_artist(self.heads[i])
+            self.canvas.blit(ax.bbox)
+        self.update_frame_time(start)
 
         self.index += 1
-        # self.after_id = self.root.after(2000, self.animate_step)
-        self.root.after(10, self.animate_step)
+        self.animate_after = self.root.after(self.frame_interval, self.animate_step)
+
+    def update_frame_time(self, start):
+        # moving averages of the time spent per frame and between frames
+        now = time.perf_counter()
+        cost = now - start
+        if instrument.enabled:
+            instrument.frame("animate_step", cost)
+        if self.last_frame is None:
+            self.frame_cost, self.frame_period = cost, None
+        else:
+            period = now - self.last_frame
+            self.frame_cost += 0.1 * (cost - self.frame_cost)
+            if self.frame_period is None:
+                self.frame_period = period
+            self.frame_period += 0.1 * (period - self.frame_period)
+        self.last_frame = now
+
+        if self.index % 10 == 0 and self.frame_period:
+            self.frame_label.config(
+                text=f"step {self.index}: {1 / self.frame_period:.0f} fps, "
+                f"{1e3 * self.frame_cost:.1f} ms/frame"
+            )
 
     def set_gradient_descent(self, descent: str):
         assert descent in ["simultaneous", "alternating"]
@@ -531,6 +858,18 @@ class DiracGANPlot:
 
 
 if __name__ == "__main__":
+    # DIRACGAN_INSTRUMENT=stats.json shows counts and timings in a status
+    # line and writes them to stats.json on exit
+    stats = os.environ.get("DIRACGAN_INSTRUMENT")
+    if stats:
+        instrument.enable()
     root = tk.Tk()
+    # show the window while matplotlib and the first trajectories load
+    loading = ttk.Label(root, text="Loading...")
+    loading.pack(expand=True)
+    root.update()
     app = DiracGANPlot(root)
+    loading.destroy()
     root.mainloop()
+    if stats:
+        instrument.dump(stats)
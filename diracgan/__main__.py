@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from diracgan import instrument
+from diracgan.presets import DEFAULT_PARAMS, DEFAULT_RUN, make_gans, simulate_gans
+from diracgan.simulate import SCHEMES
+
+
+# Headless entry point:
+#
+#     python -m diracgan run --out results --param WGAN_clip=0.5 --h-g 0.3
+#     python -m diracgan sweep ...      (diracgan.sweep)
+#     python -m diracgan critical ...   (diracgan.critical)
+#     python -m diracgan run --instrument stats.json   (diracgan.instrument)
+#
+# `run` does what the GUI shows for one setting of its controls: the
+# trajectories of all ten GANs, simulated in parallel and written as raw
+# arrays, an overview figure and one animation per GAN. Only the Agg
+# backend of matplotlib is used, nothing imports tkinter.
+
+FORMATS = ('npz', 'png', 'gif')
+
+
+def parse_param(text):
+    name, _, value = text.partition('=')
+    if name not in DEFAULT_PARAMS:
+        raise argparse.ArgumentTypeError(
+            'Unknown GAN parameter %r, choose from %s'
+            % (name, ', '.join(DEFAULT_PARAMS)))
+    return name, float(value)
+
+
+def run(args):
+    params = dict(DEFAULT_PARAMS)
+    params.update(args.param)
+    settings = {'theta0': args.theta0, 'psi0': args.psi0, 'h_g': args.h_g,
+                'h_d': args.h_d, 'n_steps': args.n_steps, 'gsteps': args.gsteps,
+                'dsteps': args.dsteps, 'scheme': args.scheme}
+    formats = [f for f in args.formats.split(',') if f]
+    for f in formats:
+        if f not in FORMATS:
+            raise ValueError('Unknown format %r' % (f,))
+    if not os.path.exists(args.out):
+        os.makedirs(args.out)
+    if args.instrument:
+        instrument.enable()
+    try:
+        _run(args, params, settings, formats)
+    finally:
+        if args.instrument:
+            instrument.dump(args.instrument)
+
+
+def _run(args, params, settings, formats):
+    gans = make_gans(params)
+    names = [gan.__class__.__name__ for gan in gans]
+    trajectories = simulate_gans(gans, settings, workers=args.workers)
+
+    if 'npz' in formats:
+        config = json.dumps({'params': params, 'run': settings})
+        arrays = dict(zip(names, (t.data for t in trajectories)))
+        np.savez(os.path.join(args.out, 'trajectories.npz'),
+                 names=np.array(names), config=np.array(config), **arrays)
+
+    if 'png' not in formats and 'gif' not in formats:
+        return
+    import matplotlib
+    matplotlib.use('Agg')
+    from diracgan.plotting import plot_comparison, simulate_trajectories
+
+    theta = np.linspace(-2, 2, 10)
+    psi = np.linspace(-2, 2, 10)
+    if 'png' in formats:
+        with instrument.stage('draw'):
+            plot_comparison(gans, trajectories, theta, psi,
+                            os.path.join(args.out, 'comparison.png'),
+                            dpi=args.dpi)
+    if 'gif' in formats:
+        for name, gan, trajectory in zip(names, gans, trajectories):
+            sys.stderr.write('%s\n' % name)
+            simulate_trajectories(
+                gan, theta, psi, (trajectory.thetas, trajectory.psis),
+                os.path.join(args.out, name + '.gif'),
+                maxframes=args.maxframes, workers=args.workers, fps=args.fps)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    commands = ('run', 'sweep', 'critical')
+    if not argv or argv[0] not in commands:
+        sys.stderr.write('usage: python -m diracgan {%s} ...\n'
+                         % ','.join(commands))
+        sys.exit(2)
+    command, rest = argv[0], argv[1:]
+    if command == 'sweep':
+        from diracgan.sweep import main as sweep_main
+        return sweep_main(rest)
+    if command == 'critical':
+        from diracgan.critical import main as critical_main
+        return critical_main(rest)
+
+    parser = argparse.ArgumentParser(
+        prog='python -m diracgan run',
+        description='Simulate the ten GANs of the GUI and write the results.')
+    parser.add_argument('--out', default='diracgan_run',
+                        help='output directory')
+    parser.add_argument('--param', action='append', type=parse_param,
+                        default=[], metavar='NAME=VALUE',
+                        help='GAN parameter as in the GUI, may be repeated')
+    parser.add_argument('--theta0', type=float, default=DEFAULT_RUN['theta0'])
+    parser.add_argument('--psi0', type=float, default=DEFAULT_RUN['psi0'])
+    parser.add_argument('--h-g', type=float, default=DEFAULT_RUN['h_g'])
+    parser.add_argument('--h-d', type=float, default=DEFAULT_RUN['h_d'])
+    parser.add_argument('--n-steps', type=int, default=DEFAULT_RUN['n_steps'])
+    parser.add_argument('--gsteps', type=int, default=DEFAULT_RUN['gsteps'])
+    parser.add_argument('--dsteps', type=int, default=DEFAULT_RUN['dsteps'])
+    parser.add_argument('--scheme', default=DEFAULT_RUN['scheme'],
+                        choices=SCHEMES)
+    parser.add_argument('--formats', default='npz,png,gif',
+                        help='comma separated subset of %s' % ','.join(FORMATS))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--maxframes', type=int, default=300)
+    parser.add_argument('--instrument', metavar='JSON',
+                        help='count vector field evaluations, time the stages '
+                        'and frames and write the results to this file')
+    run(parser.parse_args(rest))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import numpy as np
+from diracgan.simulate import (SCHEMES, _simgd_step, _altgd_step,
+                               _batch_start)
+
+
+# Status of a start point after a convergence run
+CONVERGED = 0   # came within tol of (0, 0)
+CONVERGING = 1  # still approaching (0, 0) after nsteps
+CYCLING = 2     # neither approaching nor leaving (0, 0) after nsteps
+DIVERGED = 3    # left the max_norm ball, became non-finite or keeps leaving
+STATUS_NAMES = ('converged', 'converging', 'cycling', 'diverged')
+
+
+# Result of convergence_map. All arrays have shape (len(psi), len(theta)),
+# the layout of np.meshgrid(theta, psi), so they can be passed to imshow or
+# pcolormesh directly.
+#
+# `steps` is the step at which a point converged or diverged past max_norm,
+# nsteps for points still running at the end; `distance` is the distance to
+# (0, 0) at that step.
+class ConvergenceMap(object):
+    def __init__(self, theta, psi, steps, distance, status, nsteps):
+        self.theta = theta
+        self.psi = psi
+        self.steps = steps
+        self.distance = distance
+        self.status = status
+        self.nsteps = nsteps
+
+    @property
+    def converged(self):
+        return self.status == CONVERGED
+
+    def fraction(self, status):
+        return np.mean(self.status == status)
+
+    def __repr__(self):
+        counts = ', '.join('%s=%.3f' % (name, self.fraction(i))
+                           for i, name in enumerate(STATUS_NAMES))
+        return 'ConvergenceMap(shape=%s, nsteps=%d, %s)' % (
+            self.status.shape, self.nsteps, counts)
+
+
+def convergence_map(vec_fn, theta, psi, nsteps=1000, hs_g=0.1, hs_d=0.1,
+                    scheme='simultaneous', gsteps=1, dsteps=1, tol=1e-3,
+                    max_norm=1e3, cycle_rtol=1e-2, chunk_size=65536):
+    # Runs gradient descent from every point of the grid spanned by the 1d
+    # arrays theta and psi. Step sizes are scalars or broadcast to the grid.
+    #
+    # Start points are integrated in chunks of chunk_size without storing
+    # their history, and finished points are dropped from the batch. Points
+    # still running after nsteps are classified by comparing their smallest
+    # distance to (0, 0) over the last tenth of the steps with the tenth
+    # before.
+    if scheme not in SCHEMES:
+        raise ValueError('Unknown scheme %r' % (scheme,))
+    theta = np.asarray(theta, dtype=float)
+    psi = np.asarray(psi, dtype=float)
+    shape = (len(psi), len(theta))
+    theta0, psi0 = np.meshgrid(theta, psi)
+    hs_g = np.broadcast_to(np.asarray(hs_g, dtype=float), shape).ravel()
+    hs_d = np.broadcast_to(np.asarray(hs_d, dtype=float), shape).ravel()
+
+    n = theta0.size
+    steps = np.empty(n, dtype=np.int64)
+    distance = np.empty(n)
+    status = np.empty(n, dtype=np.int8)
+    for start in range(0, n, chunk_size):
+        chunk = slice(start, min(start + chunk_size, n))
+        _run_chunk(vec_fn, theta0.ravel()[chunk], psi0.ravel()[chunk],
+                   hs_g[chunk], hs_d[chunk], nsteps, scheme, gsteps, dsteps,
+                   tol, max_norm, cycle_rtol,
+                   steps[chunk], distance[chunk], status[chunk])
+
+    return ConvergenceMap(theta, psi, steps.reshape(shape),
+                          distance.reshape(shape), status.reshape(shape),
+                          nsteps)
+
+
+def _run_chunk(vec_fn, theta, psi, h_g, h_d, nsteps, scheme, gsteps, dsteps,
+               tol, max_norm, cycle_rtol, steps, distance, status):
+    # Fills steps, distance and status for one chunk of start points
+    theta, psi = _batch_start(vec_fn, theta, psi)
+    idx = np.arange(theta.size)
+    window = max(1, nsteps // 10)
+    last_start = nsteps - window + 1
+    prev_start = max(0, last_start - window)
+    rmin_prev = rmin_last = None
+    buf = np.empty(theta.size), np.empty(theta.size)
+
+    for k in range(nsteps + 1):
+        if k > 0:
+            m = theta.size
+            work = buf[0][:m], buf[1][:m]
+            if scheme == 'simultaneous':
+                theta, psi = _simgd_step(vec_fn, theta, psi, h_g, h_d, work)
+            else:
+                theta, psi = _altgd_step(vec_fn, theta, psi, h_g, h_d,
+                                         gsteps, dsteps, work)
+
+        r = np.hypot(theta, psi)
+        if k == prev_start:
+            rmin_prev = r.copy()
+        elif prev_start < k < last_start:
+            np.minimum(rmin_prev, r, out=rmin_prev)
+        elif k == last_start:
+            rmin_last = r.copy()
+        elif k > last_start:
+            np.minimum(rmin_last, r, out=rmin_last)
+
+        converged = r < tol
+        diverged = ~(r <= max_norm)
+        done = converged | diverged
+        if k == nsteps:
+            done[:] = True
+        if not done.any():
+            continue
+
+        i = idx[done]
+        steps[i] = k
+        distance[i] = r[done]
+        final = np.where(converged[done], CONVERGED, DIVERGED)
+        if k == nsteps and rmin_last is not None:
+            running = ~(converged | diverged)
+            final[running[done]] = _classify(
+                rmin_prev[running], rmin_last[running], cycle_rtol)
+        elif k == nsteps:
+            final[~(converged | diverged)] = CYCLING
+        status[i] = final
+
+        keep = ~done
+        if not keep.any():
+            break
+        idx = idx[keep]
+        theta, psi = theta[keep], psi[keep]
+        h_g, h_d = h_g[keep], h_d[keep]
+        if rmin_prev is not None:
+            rmin_prev = rmin_prev[keep]
+        if rmin_last is not None:
+            rmin_last = rmin_last[keep]
+
+
+def _classify(rmin_prev, rmin_last, cycle_rtol):
+    status = np.full(rmin_prev.shape, CYCLING, dtype=np.int8)
+    status[rmin_last < (1 - cycle_rtol) * rmin_prev] = CONVERGING
+    status[rmin_last > (1 + cycle_rtol) * rmin_prev] = DIVERGED
+    return status
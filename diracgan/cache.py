@@ -0,0 +1,159 @@
+from collections import OrderedDict
+
+import numpy as np
+from diracgan import fieldgrid
+from diracgan.simulate import trajectory_gd
+
+
+# LRU cache for trajectories and vector field grids. Entries are keyed by
+# the GAN (VectorField.cache_key) and every simulation parameter, and the
+# least recently used ones are evicted once their arrays exceed max_bytes.
+#
+# Trajectories are stored once per configuration regardless of nsteps:
+# asking for fewer steps than stored returns a view, asking for more resumes
+# the stored trajectory and only simulates the missing steps. Returned
+# arrays are read-only since they are shared between callers.
+class TrajectoryCache(object):
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.extensions = 0
+        self._entries = OrderedDict()
+
+    def trajectory(self, vec_fn, theta0, psi0, nsteps=50, hs_g=0.1, hs_d=0.1,
+                   scheme='simultaneous', gsteps=1, dsteps=1):
+        key = self.trajectory_key(vec_fn, theta0, psi0, hs_g, hs_d,
+                                  scheme, gsteps, dsteps)
+        if key is None:
+            return trajectory_gd(vec_fn, theta0, psi0, nsteps=nsteps,
+                                 hs_g=hs_g, hs_d=hs_d, scheme=scheme,
+                                 gsteps=gsteps, dsteps=dsteps)
+
+        view = self.get_trajectory(key, nsteps)
+        if view is None:
+            trajectory = trajectory_gd(vec_fn, theta0, psi0, nsteps=nsteps,
+                                       hs_g=hs_g, hs_d=hs_d, scheme=scheme,
+                                       gsteps=gsteps, dsteps=dsteps,
+                                       resume=self.stored_trajectory(key))
+            self.put_trajectory(key, trajectory)
+            view = self.get_trajectory(key, nsteps, count=False)
+        return view
+
+    # The methods below split trajectory() up for callers that simulate
+    # elsewhere, e.g. in a worker process
+
+    def trajectory_key(self, vec_fn, theta0, psi0, hs_g=0.1, hs_d=0.1,
+                       scheme='simultaneous', gsteps=1, dsteps=1):
+        gan_key = vec_fn.cache_key()
+        if (gan_key is None
+                or not isinstance(hs_g, float) or not isinstance(hs_d, float)):
+            return None
+        if scheme == 'simultaneous':
+            gsteps = dsteps = 1
+        return ('trajectory', gan_key, float(theta0), float(psi0), hs_g, hs_d,
+                scheme, gsteps, dsteps)
+
+    def get_trajectory(self, key, nsteps, count=True):
+        # Read-only view of the first nsteps steps, or None if fewer are stored
+        trajectory = self._get(key)
+        if trajectory is None or trajectory.nsteps < nsteps:
+            return None
+        if count:
+            self.hits += 1
+        view = trajectory[:nsteps + 1]
+        view.data.flags.writeable = False
+        return view
+
+    def stored_trajectory(self, key):
+        # Longest trajectory stored for this configuration, to be resumed
+        return self._get(key)
+
+    def put_trajectory(self, key, trajectory):
+        # `trajectory` may be the stored one, resumed in place
+        stored = self._get(key)
+        if stored is None:
+            self.misses += 1
+        elif stored is trajectory or stored.nsteps < trajectory.nsteps:
+            self.extensions += 1
+        else:
+            return
+        self._put(key, trajectory, trajectory.nbytes)
+
+    def vector_grid(self, vec_fn, theta, psi):
+        # Vector field on np.meshgrid(theta, psi)
+        gan_key = vec_fn.cache_key()
+        if gan_key is None:
+            return vec_fn(*np.meshgrid(theta, psi))
+
+        theta = np.asarray(theta, dtype=float)
+        psi = np.asarray(psi, dtype=float)
+        key = ('grid', gan_key, theta.tobytes(), psi.tobytes())
+        v = self._get(key)
+        if v is None:
+            self.misses += 1
+            v = vec_fn(*np.meshgrid(theta, psi))
+            for a in v:
+                a.flags.writeable = False
+            self._put(key, v, v[0].nbytes + v[1].nbytes)
+        else:
+            self.hits += 1
+        return v
+
+    def field_tile(self, vec_fn, level, i, j):
+        # Vector field on tile (i, j) of the lattice at `level`, see fieldgrid
+        gan_key = vec_fn.cache_key()
+        key = ('tile', gan_key, level, i, j)
+        v = None if gan_key is None else self._get(key)
+        if v is not None:
+            self.hits += 1
+            return v
+        theta = fieldgrid.tile_coords(level, i)
+        psi = fieldgrid.tile_coords(level, j)
+        v = vec_fn(*np.meshgrid(theta, psi))
+        if gan_key is not None:
+            self.misses += 1
+            for a in v:
+                a.flags.writeable = False
+            self._put(key, v, v[0].nbytes + v[1].nbytes)
+        return v
+
+    def has_field_tile(self, vec_fn, level, i, j):
+        # GANs that cannot be cached are evaluated on demand and never miss
+        gan_key = vec_fn.cache_key()
+        return gan_key is None or ('tile', gan_key, level, i, j) in self._entries
+
+    def _get(self, key):
+        try:
+            value, nbytes = self._entries[key]
+        except KeyError:
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key, value, nbytes):
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+        if nbytes <= self.max_bytes:
+            self._entries[key] = value, nbytes
+            self.nbytes += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            key, (value, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'extensions': self.extensions,
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+        }
@@ -0,0 +1,225 @@
+import argparse
+import itertools
+
+import numpy as np
+
+from diracgan.simulate import (SCHEMES, CONVERGED, STOP_REASONS,
+                               trajectory_simgd_batch, trajectory_altgd_batch)
+from diracgan.spectral import jacobian, gd_spectrum
+from diracgan.sweep import gan_class, format_table, parse_values
+
+
+# Largest step sizes for which GD still converges to the equilibrium.
+#
+# Step sizes are h_g = h and h_d = ratio * h. The critical h is the end of
+# the interval (0, h] of converging step sizes, found by multisection: each
+# pass evaluates ncandidates step sizes at once and keeps the interval
+# between the last converging and the first diverging one. Convergence is
+# judged either from the spectrum of the update map at (0, 0) (local, any
+# array of GAN parameters at once) or by simulating from a grid of start
+# points (from a region, one GAN at a time).
+
+GAN_NAMES = ('GAN', 'NSGAN', 'WGAN', 'WGAN_GP', 'GAN_InstNoise',
+             'GAN_GradPenalty', 'NSGAN_GradPenalty', 'GAN_Consensus',
+             'LeCamGAN', 'LSGAN')
+
+COLUMNS = ('h_g', 'h_d', 'best_h_g', 'rate_per_grad')
+
+
+def default_gan(name, **params):
+    cls = gan_class(name)
+    if name == 'GAN_InstNoise':
+        # deterministic expectation so that simulations can be compared
+        params.setdefault('method', 'quadrature')
+    return cls(**params)
+
+
+def multisection(converges, shape, h_max, ncandidates=16, npasses=6):
+    # converges(h) maps candidates of shape shape + (n,) to a boolean array
+    # of the same shape. Returns (lo, hi) with converging lo and diverging hi,
+    # lo = 0 where no candidate converged and hi = h_max where all did.
+    lo = np.zeros(shape)
+    hi = np.full(shape, float(h_max))
+    fractions = np.arange(1, ncandidates + 1) / ncandidates
+    for _ in range(npasses):
+        candidates = lo[..., None] + (hi - lo)[..., None] * fractions
+        ok = converges(candidates)
+        # the first candidate that does not converge, ncandidates if none
+        first = np.where(ok.all(axis=-1), ncandidates, np.argmin(ok, axis=-1))
+        below = np.take_along_axis(
+            candidates, np.maximum(first - 1, 0)[..., None], axis=-1)[..., 0]
+        above = np.take_along_axis(
+            candidates, np.minimum(first, ncandidates - 1)[..., None],
+            axis=-1)[..., 0]
+        lo = np.where(first == 0, lo, below)
+        hi = np.where(first == ncandidates, hi, above)
+    return lo, hi
+
+
+def spectral_test(J, ratio=1., scheme='simultaneous', gsteps=1, dsteps=1):
+    # Local convergence test for the Jacobians J of shape (..., 2, 2)
+    J = np.asarray(J)[..., None, :, :]
+
+    def converges(h):
+        return gd_spectrum(J, h, ratio * h, scheme, gsteps, dsteps).stable
+    return converges
+
+
+def simulation_test(vec_fn, ratio=1., scheme='simultaneous', gsteps=1,
+                    dsteps=1, region=((-1., 1.), (-1., 1.)), npoints=5,
+                    nsteps=1000, tol=1e-3, max_norm=1e3):
+    # Convergence test that requires every point of an npoints x npoints grid
+    # over the region to come within tol of (0, 0) in nsteps
+    theta0, psi0 = np.meshgrid(np.linspace(*region[0], npoints),
+                               np.linspace(*region[1], npoints))
+    theta0, psi0 = theta0.ravel(), psi0.ravel()
+
+    def converges(h):
+        h = np.asarray(h)
+        hs = np.repeat(h.ravel(), len(theta0))
+        thetas = np.tile(theta0, h.size)
+        psis = np.tile(psi0, h.size)
+        with np.errstate(all='ignore'):
+            if scheme == 'simultaneous':
+                trajectory = trajectory_simgd_batch(
+                    vec_fn, thetas, psis, nsteps=nsteps, hs_g=hs,
+                    hs_d=ratio * hs, tol=tol, max_norm=max_norm)
+            else:
+                trajectory = trajectory_altgd_batch(
+                    vec_fn, thetas, psis, nsteps=nsteps, hs_g=hs,
+                    hs_d=ratio * hs, gsteps=gsteps, dsteps=dsteps, tol=tol,
+                    max_norm=max_norm)
+        converged = trajectory.stop_reason == STOP_REASONS.index(CONVERGED)
+        return converged.reshape(h.shape + (len(theta0),)).all(axis=-1)
+    return converges
+
+
+def critical_step(vec_fn, ratio=1., scheme='simultaneous', gsteps=1, dsteps=1,
+                  method='spectral', h_max=4., ncandidates=16, npasses=None,
+                  **simulation):
+    # Critical h for vec_fn, an array over its array-valued parameters with
+    # method='spectral'. Extra keywords go to simulation_test.
+    if scheme not in SCHEMES:
+        raise ValueError('Unknown scheme %r' % (scheme,))
+    if method == 'spectral':
+        J = jacobian(vec_fn)
+        converges = spectral_test(J, ratio, scheme, gsteps, dsteps)
+        shape = J.shape[:-2]
+        npasses = 6 if npasses is None else npasses
+    elif method == 'simulation':
+        converges = simulation_test(vec_fn, ratio, scheme, gsteps, dsteps,
+                                    **simulation)
+        shape = ()
+        npasses = 3 if npasses is None else npasses
+    else:
+        raise ValueError('Unknown method %r' % (method,))
+    lo, hi = multisection(converges, shape, h_max, ncandidates, npasses)
+    return lo
+
+
+def best_rate(vec_fn, h_crit, ratio=1., scheme='simultaneous', gsteps=1,
+              dsteps=1, ncandidates=256):
+    # Step size below h_crit with the fastest local convergence, and that
+    # rate per gradient evaluation
+    evals = 1 if scheme == 'simultaneous' else gsteps + dsteps
+    h = np.asarray(h_crit)[..., None] * np.arange(1, ncandidates) / ncandidates
+    J = np.asarray(jacobian(vec_fn))[..., None, :, :]
+    rate = gd_spectrum(J, h, ratio * h, scheme, gsteps, dsteps).rate / evals
+    i = np.argmax(rate, axis=-1)[..., None]
+    return (np.take_along_axis(h, i, axis=-1)[..., 0],
+            np.take_along_axis(rate, i, axis=-1)[..., 0])
+
+
+def critical_table(names=GAN_NAMES, ratio=1., scheme='simultaneous',
+                   max_steps=1, method='spectral', h_max=4., **simulation):
+    # Rows of (config, columns) as for sweep.format_table: per GAN and
+    # (gsteps, dsteps) up to max_steps the critical step sizes and the best
+    # rate per gradient evaluation, best (gsteps, dsteps) first per GAN
+    rows = []
+    pairs = [(1, 1)]
+    if scheme == 'alternating':
+        pairs = list(itertools.product(range(1, max_steps + 1), repeat=2))
+    for name in names:
+        gan_rows = []
+        for gsteps, dsteps in pairs:
+            vec_fn = default_gan(name)
+            h = float(critical_step(vec_fn, ratio, scheme, gsteps, dsteps,
+                                    method, h_max, **simulation))
+            best_h, rate = best_rate(vec_fn, h, ratio, scheme, gsteps, dsteps)
+            config = {'gan': name, 'scheme': scheme, 'gsteps': gsteps,
+                      'dsteps': dsteps}
+            columns = {'h_g': h, 'h_d': ratio * h, 'best_h_g': float(best_h),
+                       'rate_per_grad': float(rate) if h > 0 else 0.}
+            gan_rows.append((config, columns))
+        gan_rows.sort(key=lambda row: -row[1]['rate_per_grad'])
+        rows += gan_rows
+    return rows
+
+
+def critical_curve(name, param, values, ratio=1., scheme='simultaneous',
+                   gsteps=1, dsteps=1, method='spectral', h_max=4.,
+                   **simulation):
+    # Critical h over values of one GAN parameter, e.g. the regularisation
+    # strength; spectral curves come from a single vectorized multisection
+    values = np.asarray(values, dtype=float)
+    if method == 'spectral':
+        vec_fn = default_gan(name, **{param: values})
+        return critical_step(vec_fn, ratio, scheme, gsteps, dsteps, method,
+                             h_max)
+    return np.array([
+        critical_step(default_gan(name, **{param: float(v)}), ratio, scheme,
+                      gsteps, dsteps, method, h_max, **simulation)
+        for v in values])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m diracgan.critical',
+        description='Find the largest step sizes for which GD converges.')
+    parser.add_argument('--gan', action='append', default=None,
+                        help='VectorField class name, may be repeated '
+                             '(default: all)')
+    parser.add_argument('--scheme', default='simultaneous', choices=SCHEMES)
+    parser.add_argument('--ratio', type=float, default=1.,
+                        help='h_d / h_g')
+    parser.add_argument('--max-steps', type=int, default=3,
+                        help='largest gsteps and dsteps tried (alternating)')
+    parser.add_argument('--method', default='spectral',
+                        choices=('spectral', 'simulation'))
+    parser.add_argument('--h-max', type=float, default=4.)
+    parser.add_argument('--nsteps', type=int, default=1000,
+                        help='steps per simulation')
+    parser.add_argument('--curve', metavar='PARAM=VALUES', default=None,
+                        help='critical h over a parameter, values as a,b,c '
+                             'or start:stop:num')
+    parser.add_argument('--plot', default=None, help='image file for --curve')
+    args = parser.parse_args(argv)
+
+    names = args.gan or GAN_NAMES
+    simulation = {}
+    if args.method == 'simulation':
+        simulation['nsteps'] = args.nsteps
+
+    if args.curve is None:
+        rows = critical_table(names, args.ratio, args.scheme, args.max_steps,
+                              args.method, args.h_max, **simulation)
+        print(format_table(rows, COLUMNS))
+        return
+
+    param, _, values = args.curve.partition('=')
+    values = np.asarray(parse_values(values), dtype=float)
+    curves = {}
+    for name in names:
+        curves[name] = critical_curve(name, param, values, args.ratio,
+                                      args.scheme, method=args.method,
+                                      h_max=args.h_max, **simulation)
+    rows = [({param: float(v)}, {name: float(curves[name][i]) for name in names})
+            for i, v in enumerate(values)]
+    print(format_table(rows, names))
+    if args.plot is not None:
+        from diracgan.plotting import plot_critical_curve
+        plot_critical_curve(values, curves, args.plot, param)
+
+
+if __name__ == '__main__':
+    main()
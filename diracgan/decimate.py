@@ -0,0 +1,146 @@
+import numpy as np
+
+
+# Level of detail for plotting long trajectories
+#
+# Trajectories of 10^4 - 10^5 steps mostly pile up at the equilibrium, where
+# thousands of markers cover the same few pixels. Before plotting, they are
+# reduced to one point per pixel (markers: the first point on every pixel
+# of the view, lines: the ends of runs of consecutive points on one pixel)
+# and then to about `per_pixel` points per pixel of axes width by one of
+#
+#   lttb    Largest-Triangle-Three-Buckets: per bucket of consecutive points
+#           the one spanning the largest triangle with the point kept before
+#           and the mean of the next bucket, which keeps turns and extremes
+#   minmax  per bucket the points with the smallest and largest theta and
+#           psi, fully vectorized and cheap enough for every frame
+#
+# All functions take points as an (N, 2) array of (theta, psi) rows, return
+# indices into it in increasing order and keep the first and last point.
+# Axes are duck-typed, this module does not import matplotlib.
+
+
+def lttb(points, n):
+    N = len(points)
+    if n >= N or N < 3:
+        return np.arange(N)
+    n = max(n, 3)
+    points = np.asarray(points, dtype=float)
+    # n - 2 buckets between the first and the last point
+    edges = np.linspace(1, N - 1, n - 1).astype(int)
+    sums = np.add.reduceat(points[1:N - 1], edges[:-1] - 1)
+    means = sums / np.diff(edges)[:, None]
+    # the bucket after the last one is the last point
+    means = np.concatenate([means[1:], points[-1:]])
+
+    indices = np.empty(n, dtype=int)
+    indices[0] = 0
+    indices[-1] = N - 1
+    a = points[0]
+    for b in range(n - 2):
+        bucket = points[edges[b]:edges[b + 1]]
+        c = means[b]
+        # twice the triangle areas, the factor does not change the argmax
+        area = np.abs((a[0] - c[0]) * (bucket[:, 1] - a[1])
+                      - (a[0] - bucket[:, 0]) * (c[1] - a[1]))
+        j = edges[b] + int(np.argmax(area))
+        indices[b + 1] = j
+        a = points[j]
+    return indices
+
+
+def minmax(points, n):
+    N = len(points)
+    if n >= N or N < 3:
+        return np.arange(N)
+    # four points per bucket
+    nbuckets = max(1, n // 4)
+    size = -(-(N - 2) // nbuckets)
+    nbuckets = -(-(N - 2) // size)
+    inner = np.asarray(points[1:N - 1], dtype=float)
+    pad = nbuckets * size - len(inner)
+    if pad:
+        inner = np.concatenate([inner, np.repeat(inner[-1:], pad, axis=0)])
+    buckets = inner.reshape(nbuckets, size, 2)
+    offsets = 1 + size * np.arange(nbuckets)[:, None]
+    picks = np.concatenate([np.argmin(buckets, axis=1),
+                            np.argmax(buckets, axis=1)], axis=1) + offsets
+    picks = np.minimum(picks, N - 2)
+    return np.unique(np.concatenate([[0], picks.ravel(), [N - 1]]))
+
+
+METHODS = {'lttb': lttb, 'minmax': minmax}
+
+
+def decimate(points, n, method='lttb'):
+    # At most about n of the points, points itself when it has no more
+    if len(points) <= n:
+        return points
+    if method not in METHODS:
+        raise ValueError('Unknown method %r' % (method,))
+    return points[METHODS[method](points, n)]
+
+
+def pixel_budget(ax, per_pixel=2.):
+    # Number of points for the current width of ax in pixels
+    return max(3, int(per_pixel * ax.bbox.width))
+
+
+def in_view(points, ax, margin=0.05):
+    # Mask of the points inside the view limits of ax, widened by margin
+    # times the view size so that markers on the border stay
+    x0, x1 = sorted(ax.get_xlim())
+    y0, y1 = sorted(ax.get_ylim())
+    dx = margin * (x1 - x0)
+    dy = margin * (y1 - y0)
+    x, y = points[:, 0], points[:, 1]
+    return (x >= x0 - dx) & (x <= x1 + dx) & (y >= y0 - dy) & (y <= y1 + dy)
+
+
+def _pixels(points, ax):
+    x0, x1 = ax.get_xlim()
+    y0, y1 = ax.get_ylim()
+    scale = np.array([ax.bbox.width / (x1 - x0), ax.bbox.height / (y1 - y0)])
+    with np.errstate(invalid='ignore'):
+        return np.floor(points * scale)
+
+
+def first_pixels(points, ax):
+    # Indices of the first point on every pixel of ax, for markers that look
+    # the same wherever they repeat; points must be finite
+    cells = _pixels(points, ax)
+    cells -= cells.min(axis=0)
+    key = cells[:, 0].astype(np.int64) * (int(cells[:, 1].max()) + 1) \
+        + cells[:, 1].astype(np.int64)
+    _, first = np.unique(key, return_index=True)
+    return np.sort(first)
+
+
+def new_pixels(points, ax):
+    # Mask of the points on another pixel of ax than the point before, a
+    # run of points on one pixel looks the same as its first and last point
+    cells = _pixels(points, ax)
+    keep = np.empty(len(points), dtype=bool)
+    keep[0] = True
+    keep[1:] = np.any(cells[1:] != cells[:-1], axis=1)
+    keep[:-1] |= keep[1:]
+    keep[-1] = True
+    return keep
+
+
+def decimate_view(points, ax, method='lttb', per_pixel=2., markers=True):
+    # The points to draw into ax, reduced to its pixel budget; cheap when
+    # the trajectory already fits the budget. Markers are taken from the
+    # view only, lines (markers=False) keep their order and every point, as
+    # dropping those outside would join their ends.
+    points = np.asarray(points)
+    n = pixel_budget(ax, per_pixel)
+    if len(points) <= n:
+        return points
+    if markers:
+        points = points[in_view(points, ax)]
+        if len(points):
+            points = points[first_pixels(points, ax)]
+    else:
+        points = points[new_pixels(points, ax)]
+    return decimate(points, n, method)
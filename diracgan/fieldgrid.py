@@ -0,0 +1,85 @@
+import math
+
+import numpy as np
+
+
+# Vector field grids matched to a viewport
+#
+# Arrows sit on a lattice ORIGIN + k * spacing(level) in theta and psi,
+# where every level halves the spacing of the one before. Level 0 is the
+# GUI's original 10 x 10 grid on [-2, 2]. For a view the level is chosen so
+# that between `arrows` and 2 * `arrows` lattice points fall across it, and
+# the grid is assembled from TILE x TILE tiles of the lattice cached per GAN
+# (TrajectoryCache.field_tile). Panning reuses the tiles already evaluated,
+# zooming evaluates the tiles of the new level one at a time, see
+# missing_tiles.
+
+ORIGIN = -2.
+BASE = 4. / 9.
+TILE = 16
+MIN_LEVEL = -40
+MAX_LEVEL = 40
+
+
+def spacing(level):
+    return BASE * 2.**-level
+
+
+def choose_level(xlim, ylim, arrows=10):
+    span = min(abs(xlim[1] - xlim[0]), abs(ylim[1] - ylim[0]))
+    if not span > 0:
+        return 0
+    level = math.ceil(math.log2(BASE * (arrows - 1) / span))
+    return min(max(level, MIN_LEVEL), MAX_LEVEL)
+
+
+def tile_coords(level, i):
+    # Lattice coordinates of tile i along one axis
+    return ORIGIN + (TILE * i + np.arange(TILE)) * spacing(level)
+
+
+def _indices(level, lim):
+    # First and last lattice index inside lim
+    lo, hi = sorted(lim)
+    h = spacing(level)
+    return math.ceil((lo - ORIGIN) / h), math.floor((hi - ORIGIN) / h)
+
+
+def view_tiles(xlim, ylim, level):
+    # (level, i, j) of the tiles covering the view, i along theta
+    k0, k1 = _indices(level, xlim)
+    m0, m1 = _indices(level, ylim)
+    return [(level, i, j)
+            for j in range(m0 // TILE, m1 // TILE + 1)
+            for i in range(k0 // TILE, k1 // TILE + 1)]
+
+
+def missing_tiles(cache, vec_fn, xlim, ylim, arrows=10):
+    # Tiles view_field would have to evaluate, to be filled in with
+    # cache.field_tile in chunks small enough to keep a UI responsive
+    level = choose_level(xlim, ylim, arrows)
+    return [tile for tile in view_tiles(xlim, ylim, level)
+            if not cache.has_field_tile(vec_fn, *tile)]
+
+
+def view_field(cache, vec_fn, xlim, ylim, arrows=10):
+    # (theta, psi, v1, v2) of the lattice points in the view, with v1 and v2
+    # of shape (len(psi), len(theta)) as for np.meshgrid(theta, psi)
+    level = choose_level(xlim, ylim, arrows)
+    k0, k1 = _indices(level, xlim)
+    m0, m1 = _indices(level, ylim)
+    h = spacing(level)
+    theta = ORIGIN + np.arange(k0, k1 + 1) * h
+    psi = ORIGIN + np.arange(m0, m1 + 1) * h
+    v1 = np.empty((len(psi), len(theta)))
+    v2 = np.empty((len(psi), len(theta)))
+    for level, i, j in view_tiles(xlim, ylim, level):
+        t1, t2 = cache.field_tile(vec_fn, level, i, j)
+        # overlap of the tile with the view in lattice indices
+        a0, a1 = max(k0, TILE * i), min(k1, TILE * i + TILE - 1)
+        b0, b1 = max(m0, TILE * j), min(m1, TILE * j + TILE - 1)
+        v1[b0 - m0:b1 - m0 + 1, a0 - k0:a1 - k0 + 1] = \
+            t1[b0 - TILE * j:b1 - TILE * j + 1, a0 - TILE * i:a1 - TILE * i + 1]
+        v2[b0 - m0:b1 - m0 + 1, a0 - k0:a1 - k0 + 1] = \
+            t2[b0 - TILE * j:b1 - TILE * j + 1, a0 - TILE * i:a1 - TILE * i + 1]
+    return theta, psi, v1, v2
@@ -1,9 +1,15 @@
+import math
 import numpy as np
-from diracgan.util import sigmoid, clip
+from diracgan.util import (
+    sigmoid, sigmoid_scalar, logistic_parts, logistic_parts_scalar, clip, clip_scalar
+)
 
 
 class VectorField(object):
-    def __call__(self, theta, psi):
+    def __call__(self, theta, psi, out=None):
+        if isinstance(theta, float) and isinstance(psi, float):
+            return self._get_vector_scalar(theta, psi)
+
         theta_isfloat = isinstance(theta, float)
         psi_isfloat = isinstance(psi, float)
         if theta_isfloat:
@@ -11,7 +17,12 @@ class VectorField(object):
         if psi_isfloat:
             psi = np.array([psi])
 
-        v1, v2 = self._get_vector(theta, psi)
+        if out is None:
+            v1, v2 = self._get_vector(theta, psi)
+            # 0-d inputs give scalars, as the plain numpy expressions did
+            v1, v2 = _unwrap(v1), _unwrap(v2)
+        else:
+            v1, v2 = self._get_vector(theta, psi, out=out)
 
         if theta_isfloat:
             v1 = v1[0]
@@ -21,6 +32,9 @@ class VectorField(object):
         return v1, v2
 
     def postprocess(self, theta, psi):
+        if isinstance(theta, float) and isinstance(psi, float):
+            return self._postprocess_scalar(theta, psi)
+
         theta_isfloat = isinstance(theta, float)
         psi_isfloat = isinstance(psi, float)
         if theta_isfloat:
@@ -38,44 +52,162 @@ class VectorField(object):
     def step_sizes(self, h):
         return h, h
 
-    def _get_vector(self, theta, psi):
+    # State that changes while simulating (e.g. an RNG), so that a
+    # trajectory can be resumed exactly
+    def get_state(self):
+        return None
+
+    def set_state(self, state):
+        pass
+
+    # Identifies the field by class and parameters for caching, or None if
+    # its output is not reproducible from the parameters alone
+    def cache_key(self):
+        params = tuple(sorted(
+            (k, v) for k, v in vars(self).items() if not k.startswith('_')
+        ))
+        key = (type(self).__module__, type(self).__qualname__, params)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    # Array kernel. With `out=(v1, v2)` the result is written into these
+    # preallocated arrays, which must not alias theta or psi.
+    def _get_vector(self, theta, psi, out=None):
         raise NotImplemented
 
     def _postprocess(self, theta, psi):
         return theta, psi
 
+    # Scalar fast path on plain Python floats. Subclasses override these
+    # with math-based kernels; the defaults go through the array kernels.
+    def _get_vector_scalar(self, theta, psi):
+        v1, v2 = self._get_vector(np.array([theta]), np.array([psi]))
+        return float(v1[0]), float(v2[0])
+
+    def _postprocess_scalar(self, theta, psi):
+        if type(self)._postprocess is VectorField._postprocess:
+            return theta, psi
+        theta, psi = self._postprocess(np.array([theta]), np.array([psi]))
+        return float(theta[0]), float(psi[0])
+
+    # Jacobian of the field at the Nash equilibrium (0, 0) as a (..., 2, 2)
+    # array, broadcast over array-valued parameters, or None if there is no
+    # closed form (see spectral.jacobian)
+    def nash_jacobian(self):
+        return None
+
+
+def _outputs(theta, psi, out=None):
+    if out is None:
+        shape = np.broadcast_shapes(np.shape(theta), np.shape(psi))
+        return np.empty(shape), np.empty(shape)
+    return out
+
+
+def _unwrap(v):
+    if isinstance(v, np.ndarray) and v.ndim == 0:
+        return v[()]
+    return v
+
+
+def _jacobian(j11, j12, j21, j22):
+    j11, j12, j21, j22 = np.broadcast_arrays(
+        *[np.asarray(j, dtype=float) for j in (j11, j12, j21, j22)])
+    return np.stack([np.stack([j11, j12], axis=-1),
+                     np.stack([j21, j22], axis=-1)], axis=-2)
+
 
 # GANs
-def fp(x):
-    return sigmoid(-x)
+def fp(x, out=None, work=None):
+    return sigmoid(x, out=out, work=work, negate=True)
 
 
-def fp2(x):
-    return -sigmoid(-x) * sigmoid(x)
+def fp2(x, out=None):
+    e, r = logistic_parts(x, r=out)
+    return _fp2_from_parts(e, r)
+
+
+def _fp2_from_parts(e, r):
+    # -sigmoid(-x)*sigmoid(x) = -e*r**2 with e = exp(-|x|), r = 1/(1 + e)
+    np.multiply(r, r, out=r)
+    np.multiply(r, e, out=r)
+    return np.negative(r, out=r)
+
+
+def fp_scalar(x):
+    return sigmoid_scalar(-x)
+
+
+def fp2_scalar(x):
+    e, r = logistic_parts_scalar(x)
+    return -((r*r)*e)
+
+
+def sign_scalar(x):
+    if x == 0.:
+        return 0.
+    return math.copysign(1., x)
 
 
 class GAN(VectorField):
-    def _get_vector(self, theta, psi):
-        v1 = -psi * fp(psi*theta)
-        v2 = theta * fp(psi*theta)
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+        z = np.multiply(psi, theta, out=v2)
+        f = fp(z, out=v1, work=z)
+        np.multiply(theta, f, out=v2)
+        np.multiply(psi, f, out=v1)
+        np.negative(v1, out=v1)
         return v1, v2
 
+    def _get_vector_scalar(self, theta, psi):
+        f = fp_scalar(psi*theta)
+        return -psi * f, theta * f
+
+    # fp(0) = 1/2 and fp'(0) = -1/4 in all the closed forms below
+    def nash_jacobian(self):
+        return _jacobian(0., -0.5, 0.5, 0.)
+
 
 class NSGAN(VectorField):
-    def _get_vector(self, theta, psi):
-        v1 = -psi * fp(-psi*theta)
-        v2 = theta * fp(psi*theta)
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+        # fp(z) and fp(-z) share e and r: one is r, the other e*r
+        z = np.multiply(psi, theta, out=v2)
+        pos = np.greater(z, 0, out=np.empty(np.shape(z), dtype=bool))
+        e, r = logistic_parts(z, r=v2)
+        np.copyto(v1, r)
+        np.multiply(e, v2, out=v2, where=pos)
+        np.multiply(e, v1, out=v1, where=np.logical_not(pos, out=pos))
+        np.multiply(psi, v1, out=v1)
+        np.negative(v1, out=v1)
+        np.multiply(theta, v2, out=v2)
         return v1, v2
 
+    def _get_vector_scalar(self, theta, psi):
+        v1 = -psi * fp_scalar(-psi*theta)
+        v2 = theta * fp_scalar(psi*theta)
+        return v1, v2
+
+    def nash_jacobian(self):
+        return _jacobian(0., -0.5, 0.5, 0.)
+
 
 class WGAN(VectorField):
     def __init__(self, clip=0.3):
         super().__init__()
         self.clip = clip
 
-    def _get_vector(self, theta, psi):
-        v1 = -psi
-        v2 = theta
+    def _get_vector(self, theta, psi, out=None):
+        if out is None:
+            v1 = -psi
+            v2 = theta
+        else:
+            v1, v2 = out
+            np.negative(psi, out=v1)
+            np.copyto(v2, theta)
 
         return v1, v2
 
@@ -83,6 +215,16 @@ class WGAN(VectorField):
         psi = clip(psi, self.clip)
         return theta, psi
 
+    def _get_vector_scalar(self, theta, psi):
+        return -psi, theta
+
+    def _postprocess_scalar(self, theta, psi):
+        return theta, clip_scalar(psi, self.clip)
+
+    def nash_jacobian(self):
+        # (0, 0) lies inside the clipping range
+        return _jacobian(0., -1., 1., 0.)
+
 
 class WGAN_GP(VectorField):
     def __init__(self, reg=1., target=0.3):
@@ -90,69 +232,250 @@ class WGAN_GP(VectorField):
         self.reg = reg
         self.target = target
 
-    def _get_vector(self, theta, psi):
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+        # reg * (|psi| - target) * sign(psi), multiplying by sign(psi) last
+        np.abs(psi, out=v2)
+        np.subtract(v2, self.target, out=v2)
+        np.multiply(self.reg, v2, out=v2)
+        np.multiply(v2, np.sign(psi, out=v1), out=v2)
+        np.subtract(theta, v2, out=v2)
+        np.negative(psi, out=v1)
+        return v1, v2
+
+    def _get_vector_scalar(self, theta, psi):
         v1 = -psi
-        v2 = theta - self.reg * (np.abs(psi) - self.target) * np.sign(psi)
+        v2 = theta - self.reg * (abs(psi) - self.target) * sign_scalar(psi)
         return v1, v2
 
+    def nash_jacobian(self):
+        # The target * sign(psi) term jumps at psi = 0 and is left out, exact
+        # for target = 0
+        return _jacobian(0., -1., 1., -np.asarray(self.reg))
+
 
 class GAN_InstNoise(VectorField):
-    def __init__(self, std=1):
+    # The expectation over the instance noise is estimated either by
+    # Monte-Carlo sampling (method='mc') or by Gauss-Hermite quadrature of the
+    # given order (method='quadrature'). Monte-Carlo samples come from the
+    # global np.random state unless a seed is given; with
+    # common_random_numbers=True the same samples are reused for every call.
+    def __init__(self, std=1, method='mc', order=20, nsamples=1000, seed=None,
+                 common_random_numbers=False):
+        if method not in ('mc', 'quadrature'):
+            raise ValueError('Unknown method %r' % (method,))
         self.std = std
+        self.method = method
+        self.order = order
+        self.nsamples = nsamples
+        self.seed = seed
+        self.common_random_numbers = common_random_numbers
+        self.rng = None if seed is None else np.random.default_rng(seed)
+        self._nodes = None
+        self._samples = None
+
+    def _noise(self, shape):
+        # Noise for theta and for the data point, stacked along axis 0, and
+        # the weights of the expectation (None for a plain mean)
+        if self.method == 'quadrature':
+            nodes, weights = self._quadrature()
+            nodes = nodes.reshape((-1,) + (1,) * len(shape))
+            return nodes, nodes, weights
+
+        if self.common_random_numbers:
+            if self._samples is None:
+                self._samples = self._draw([2, self.nsamples])
+            eps = self._samples.reshape((2, -1) + (1,) * len(shape))
+            return eps[0], eps[1], None
+
+        eps_theta = self._draw([self.nsamples] + list(shape))
+        eps_x = self._draw([self.nsamples] + list(shape))
+        return eps_theta, eps_x, None
+
+    def get_state(self):
+        # The common random numbers belong to the state, as a fresh instance
+        # would draw other ones
+        rng_state = None if self.rng is None else self.rng.bit_generator.state
+        if rng_state is None and self._samples is None:
+            return None
+        return rng_state, self._samples
+
+    def set_state(self, state):
+        if state is None:
+            return
+        rng_state, samples = state
+        if rng_state is not None:
+            self.rng.bit_generator.state = rng_state
+        if samples is not None:
+            self._samples = samples
+
+    def cache_key(self):
+        if self.method == 'mc' and (
+                self.seed is None or not self.common_random_numbers):
+            return None
+        params = (self.std, self.method, self.order, self.nsamples, self.seed,
+                  self.common_random_numbers)
+        return (type(self).__module__, type(self).__qualname__, params)
+
+    def _quadrature(self):
+        # Probabilists' Gauss-Hermite rule, normalised to weights summing to one
+        if self._nodes is None:
+            nodes, weights = np.polynomial.hermite_e.hermegauss(self.order)
+            self._nodes = nodes, weights / weights.sum()
+        return self._nodes
+
+    def _draw(self, shape):
+        if self.rng is None:
+            return np.random.randn(*shape)
+        return self.rng.standard_normal(shape)
+
+    # Noise samples are processed in blocks of about this many points in
+    # total, so that large grids do not need (samples, *shape) temporaries
+    block_size = 2**18
+
+    def _get_vector(self, theta, psi, out=None):
+        # E[-psi fp(z)] = -psi E[fp(z)] with z = psi*(theta + std*eps), and
+        # fp(z) is evaluated once for both components
+        eps_theta, eps_x, weights = self._noise(np.shape(theta))
+        n = len(eps_theta)
+        if weights is None:
+            weights = np.full(n, 1. / n)
+        v1, v2 = _outputs(theta, psi, out)
+        v1.fill(0.)
+        v2.fill(0.)
+        block = max(1, self.block_size // max(1, v1.size))
+        for start in range(0, n, block):
+            w = weights[start:start + block]
+            theta_eps = theta + self.std*eps_theta[start:start + block]
+            x_eps = self.std*eps_x[start:start + block]
+            z = np.multiply(psi, theta_eps)
+            f = fp(z, work=z)
+            v1 += np.tensordot(w, f, axes=1)
+            np.multiply(theta_eps, f, out=f)
+            v2 += np.tensordot(w, f, axes=1)
+            g = np.multiply(x_eps, psi)
+            np.negative(g, out=g)
+            g = fp(g, work=g)
+            np.multiply(x_eps, g, out=g)
+            v2 -= np.tensordot(w, g, axes=1)
+        np.multiply(psi, v1, out=v1)
+        np.negative(v1, out=v1)
+        return v1, v2
 
-    def _get_vector(self, theta, psi):
-        theta_eps = (
-            theta + self.std*np.random.randn(*([1000] + list(theta.shape)))
-        )
-        x_eps = (
-            self.std * np.random.randn(*([1000] + list(theta.shape)))
-        )
-        v1 = -psi * fp(psi*theta_eps)
-        v2 = theta_eps * fp(psi*theta_eps) - x_eps * fp(-x_eps * psi)
-        v1 = v1.mean(axis=0)
-        v2 = v2.mean(axis=0)
+    def _get_vector_scalar(self, theta, psi):
+        if self.method != 'quadrature':
+            return super()._get_vector_scalar(theta, psi)
+
+        nodes, weights = self._quadrature()
+        v1 = v2 = 0.
+        for eps, w in zip(nodes.tolist(), weights.tolist()):
+            theta_eps = theta + self.std*eps
+            x_eps = self.std*eps
+            f = fp_scalar(psi*theta_eps)
+            v1 += w * (-psi * f)
+            v2 += w * (theta_eps * f - x_eps * fp_scalar(-x_eps * psi))
         return v1, v2
 
+    def nash_jacobian(self):
+        # Of the exact expectation: d v2 / d psi = fp'(0) * 2 * std**2
+        std = np.asarray(self.std, dtype=float)
+        return _jacobian(0., -0.5, 0.5, -0.5 * std**2)
+
 
 class GAN_GradPenalty(VectorField):
     def __init__(self, reg=0.3):
         self.reg = reg
 
-    def _get_vector(self, theta, psi):
-        v1 = -psi * fp(psi*theta)
-        v2 = +theta * fp(psi*theta) - self.reg * psi
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+        z = np.multiply(psi, theta, out=v2)
+        f = fp(z, out=v1, work=z)
+        np.multiply(theta, f, out=v2)
+        np.subtract(v2, self.reg * psi, out=v2)
+        np.multiply(psi, f, out=v1)
+        np.negative(v1, out=v1)
         return v1, v2
 
+    def _get_vector_scalar(self, theta, psi):
+        f = fp_scalar(psi*theta)
+        return -psi * f, theta * f - self.reg * psi
+
+    def nash_jacobian(self):
+        return _jacobian(0., -0.5, 0.5, -np.asarray(self.reg))
+
 
 class NSGAN_GradPenalty(VectorField):
     def __init__(self, reg=0.3):
         self.reg = reg
 
-    def _get_vector(self, theta, psi):
-        v1 = -psi * fp(-psi*theta)
-        v2 = theta * fp(psi*theta) - self.reg * psi
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = NSGAN._get_vector(self, theta, psi, out)
+        np.subtract(v2, self.reg * psi, out=v2)
         return v1, v2
 
+    def _get_vector_scalar(self, theta, psi):
+        v1 = -psi * fp_scalar(-psi*theta)
+        v2 = theta * fp_scalar(psi*theta) - self.reg * psi
+        return v1, v2
+
+    def nash_jacobian(self):
+        return _jacobian(0., -0.5, 0.5, -np.asarray(self.reg))
+
 
 class GAN_Consensus(VectorField):
     def __init__(self, reg=0.3):
         self.reg = reg
 
-    def _get_vector(self, theta, psi):
-        v1 = -psi * fp(psi*theta)
-        v2 = +theta * fp(psi*theta)
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+
+        # f = fp(psi*theta) and g = fp2(psi*theta) from a single exp
+        z = np.multiply(psi, theta, out=v2)
+        pos = np.greater(z, 0, out=np.empty(np.shape(z), dtype=bool))
+        e, r = logistic_parts(z)
+        f = r.copy()
+        np.multiply(e, f, out=f, where=pos)
+        g = _fp2_from_parts(e, r)
 
         # L  0.5*(psi**2 + theta**2)*f(psi*theta)**2
-        v1reg = (
-            theta * fp(psi*theta)**2
-            + 0.5*psi * (psi**2 + theta**2) * fp(psi*theta)*fp2(psi*theta)
-        )
-        v2reg = (
-            psi * fp(psi*theta)**2
-            + 0.5*theta * (psi**2 + theta**2) * fp(psi*theta)*fp2(psi*theta)
-        )
-        v1 -= self.reg * v1reg
-        v2 -= self.reg * v2reg
+        # v1reg = theta * f**2 + psi * w, v2reg = psi * f**2 + theta * w
+        # with w = 0.5 * (psi**2 + theta**2) * f * g
+        q = np.multiply(f, f, out=e)
+        w = np.multiply(g, f, out=g)
+        np.multiply(psi, psi, out=v1)
+        np.add(v1, np.multiply(theta, theta, out=v2), out=v1)
+        np.multiply(w, v1, out=w)
+        np.multiply(w, 0.5, out=w)
+
+        v1reg = np.multiply(theta, q, out=v1)
+        np.add(v1reg, np.multiply(psi, w, out=v2), out=v1reg)
+        v2reg = np.multiply(psi, q, out=q)
+        np.add(v2reg, np.multiply(theta, w, out=w), out=v2reg)
+
+        np.multiply(v1reg, self.reg, out=v1)
+        np.add(np.multiply(psi, f, out=v2), v1, out=v1)
+        np.negative(v1, out=v1)
+        np.multiply(v2reg, self.reg, out=v2reg)
+        np.subtract(np.multiply(theta, f, out=v2), v2reg, out=v2)
+
+        return v1, v2
+
+    def _get_vector_scalar(self, theta, psi):
+        z = psi*theta
+        e, r = logistic_parts_scalar(z)
+        f = e*r if z > 0 else r
+        g = -((r*r)*e)
+
+        q = f*f
+        w = ((g*f)*(psi*psi + theta*theta))*0.5
+        v1reg = theta*q + psi*w
+        v2reg = psi*q + theta*w
+        v1 = -(psi*f + v1reg*self.reg)
+        v2 = theta*f - v2reg*self.reg
 
         return v1, v2
 
+    def nash_jacobian(self):
+        # f**2 = 1/4 at (0, 0), the w terms are of second order
+        reg = np.asarray(self.reg, dtype=float)
+        return _jacobian(-reg / 4, -0.5, 0.5, -reg / 4)
@@ -0,0 +1,316 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from diracgan.gans import VectorField
+
+
+# Optional instrumentation of the hot paths
+#
+#   vector fields  calls of the kernels (_get_vector, _get_vector_scalar,
+#                  _postprocess, _postprocess_scalar) and the number of
+#                  points they evaluated, per GAN class
+#   stages         count, total and maximum time of named stages such as
+#                  'integration', 'grid' and 'draw'
+#   frames         per-frame times of animations, the last FRAME_HISTORY
+#                  of each kept for percentiles
+#
+# It is off by default and then costs nothing: enable() wraps the kernels
+# of every VectorField subclass, also of those defined later, with
+# counting versions and disable() puts the originals back. Kernels are
+# counted where they are entered from outside, so VectorField.__call__,
+# the batched integrators and the ODE solver all count once per
+# evaluation. Callers record stages and frames only while `enabled` is
+# set. Counters are per process, jobs started with submit() count in
+# their worker and send the counts back with the result.
+#
+#     instrument.enable()
+#     ...
+#     instrument.dump('stats.json')
+
+FRAME_HISTORY = 1000
+# kernel: (counter of calls, counter of points)
+KERNELS = {
+    '_get_vector': ('calls', 'points'),
+    '_get_vector_scalar': ('calls', 'points'),
+    '_postprocess': ('postprocess', 'postprocess_points'),
+    '_postprocess_scalar': ('postprocess', 'postprocess_points'),
+}
+
+enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_originals = {}
+_fields = {}
+_stages = {}
+_frames = {}
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    classes = [VectorField]
+    for cls in classes:
+        classes.extend(c for c in cls.__subclasses__() if c not in classes)
+    for cls in classes:
+        _wrap(cls)
+    VectorField.__init_subclass__ = classmethod(_init_subclass)
+    enabled = True
+
+
+def disable():
+    global enabled
+    if not enabled:
+        return
+    del VectorField.__init_subclass__
+    for (cls, name), kernel in _originals.items():
+        setattr(cls, name, kernel)
+    _originals.clear()
+    enabled = False
+
+
+def reset():
+    with _lock:
+        _fields.clear()
+        _stages.clear()
+        _frames.clear()
+
+
+def _init_subclass(cls, **kwargs):
+    super(VectorField, cls).__init_subclass__(**kwargs)
+    _wrap(cls)
+
+
+def _wrap(cls):
+    # Only the kernels the class defines itself, inherited ones are wrapped
+    # in the class they come from
+    for name, keys in KERNELS.items():
+        kernel = cls.__dict__.get(name)
+        if kernel is not None and (cls, name) not in _originals:
+            _originals[cls, name] = kernel
+            setattr(cls, name, _counting(kernel, *keys))
+
+
+def _counting(kernel, calls, points):
+    def counted(self, theta, psi, *args, **kwargs):
+        # kernels calling other kernels (e.g. the array kernel behind a
+        # default scalar one) are counted once
+        if getattr(_local, 'inside', False):
+            return kernel(self, theta, psi, *args, **kwargs)
+        with _lock:
+            counts = _field(self)
+            counts[calls] += 1
+            counts[points] += _size(theta, psi)
+        _local.inside = True
+        try:
+            return kernel(self, theta, psi, *args, **kwargs)
+        finally:
+            _local.inside = False
+    return counted
+
+
+def _size(theta, psi):
+    if isinstance(theta, float) and isinstance(psi, float):
+        return 1
+    return max(np.size(theta), np.size(psi))
+
+
+def _field(vec_fn):
+    name = type(vec_fn).__name__
+    counts = _fields.get(name)
+    if counts is None:
+        counts = _fields[name] = {'calls': 0, 'points': 0,
+                                  'postprocess': 0, 'postprocess_points': 0}
+    return counts
+
+
+def record(name, seconds):
+    # One run of stage `name`
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = {'count': 0, 'total': 0., 'max': 0.}
+        stage['count'] += 1
+        stage['total'] += seconds
+        stage['max'] = max(stage['max'], seconds)
+
+
+def frame(name, seconds):
+    # One frame of animation `name`
+    with _lock:
+        frames = _frames.get(name)
+        if frames is None:
+            frames = _frames[name] = {'count': 0, 'recent': deque(maxlen=FRAME_HISTORY)}
+        frames['count'] += 1
+        frames['recent'].append(seconds)
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+
+
+class _Off(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_off = _Off()
+
+
+def stage(name):
+    # Context manager timing stage `name`, a shared no-op while disabled
+    if not enabled:
+        return _off
+    return _Stage(name)
+
+
+def timed(name, fn):
+    # fn recording every call as stage `name`, e.g. to replace a bound
+    # method on an instance while enabled
+    def wrapper(*args, **kwargs):
+        with _Stage(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+# Pool jobs
+
+def submit(executor, name, fn, *args, **kwargs):
+    # executor.submit(fn, *args, **kwargs) that, while enabled, counts and
+    # times fn as stage `name` in the worker process and merges the counts
+    # here when it finishes
+    if not enabled:
+        return executor.submit(fn, *args, **kwargs)
+    inner = executor.submit(_run_counted, name, fn, args, kwargs)
+    outer = Future()
+    inner.add_done_callback(lambda f: _resolve(f, outer))
+    outer.add_done_callback(lambda f: f.cancelled() and inner.cancel())
+    return outer
+
+
+def _run_counted(name, fn, args, kwargs):
+    # In a worker process, counting from zero so that only this job is sent
+    # back
+    was_enabled = enabled
+    enable()
+    reset()
+    try:
+        with _Stage(name):
+            result = fn(*args, **kwargs)
+        return result, snapshot()
+    finally:
+        reset()
+        if not was_enabled:
+            disable()
+
+
+def _resolve(inner, outer):
+    if inner.cancelled() or outer.cancelled():
+        outer.cancel()
+        return
+    try:
+        result, counts = inner.result()
+    except Exception as e:
+        _settle(outer, outer.set_exception, e)
+        return
+    merge(counts)
+    _settle(outer, outer.set_result, result)
+
+
+def _settle(future, method, value):
+    try:
+        method(value)
+    except Exception:
+        # cancelled in the meantime
+        pass
+
+
+def snapshot():
+    # Raw counts, for merge() in another process
+    with _lock:
+        return {
+            'fields': {k: dict(v) for k, v in _fields.items()},
+            'stages': {k: dict(v) for k, v in _stages.items()},
+            'frames': {k: (v['count'], list(v['recent']))
+                       for k, v in _frames.items()},
+        }
+
+
+def merge(counts):
+    with _lock:
+        for name, c in counts['fields'].items():
+            mine = _fields.setdefault(name, dict.fromkeys(c, 0))
+            for k, v in c.items():
+                mine[k] += v
+        for name, s in counts['stages'].items():
+            mine = _stages.setdefault(name, {'count': 0, 'total': 0., 'max': 0.})
+            mine['count'] += s['count']
+            mine['total'] += s['total']
+            mine['max'] = max(mine['max'], s['max'])
+        for name, (count, recent) in counts['frames'].items():
+            mine = _frames.setdefault(
+                name, {'count': 0, 'recent': deque(maxlen=FRAME_HISTORY)})
+            mine['count'] += count
+            mine['recent'].extend(recent)
+
+
+# Reports
+
+def report():
+    # JSON-ready summary, times in milliseconds
+    counts = snapshot()
+    stages = {}
+    for name, s in counts['stages'].items():
+        stages[name] = {'count': s['count'], 'total_ms': 1e3 * s['total'],
+                        'mean_ms': 1e3 * s['total'] / s['count'],
+                        'max_ms': 1e3 * s['max']}
+    frames = {}
+    for name, (count, recent) in counts['frames'].items():
+        t = 1e3 * np.array(recent)
+        frames[name] = {'count': count, 'mean_ms': float(t.mean()),
+                        'p50_ms': float(np.percentile(t, 50)),
+                        'p95_ms': float(np.percentile(t, 95)),
+                        'max_ms': float(t.max())}
+    return {'enabled': enabled, 'vector_fields': counts['fields'],
+            'stages': stages, 'frames': frames}
+
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+def summary():
+    # One line for a status bar
+    r = report()
+    calls = sum(c['calls'] for c in r['vector_fields'].values())
+    points = sum(c['points'] for c in r['vector_fields'].values())
+    parts = ['%s calls, %s points' % (_si(calls), _si(points))]
+    for name, s in sorted(r['stages'].items()):
+        parts.append('%s %.1f ms' % (name, s['mean_ms']))
+    for name, f in sorted(r['frames'].items()):
+        parts.append('%s p50 %.1f / p95 %.1f ms' % (name, f['p50_ms'], f['p95_ms']))
+    return ' | '.join(parts)
+
+
+def _si(n):
+    for div, suffix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if n >= div:
+            return '%.1f%s' % (n / div, suffix)
+    return str(n)
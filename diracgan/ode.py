@@ -0,0 +1,199 @@
+import numpy as np
+from diracgan.gans import VectorField
+from diracgan.trajectory import Trajectory
+
+
+# Reference solutions of the gradient flow
+#
+#     dtheta/dt = rate_g * v1(theta, psi),  dpsi/dt = rate_d * v2(theta, psi)
+#
+# of which simultaneous GD with hs_g = h * rate_g, hs_d = h * rate_d is the
+# explicit Euler discretisation: GD iterate k approximates the flow at
+# t = k * h. All solvers are batched over start points with one step size
+# shared by the batch, and project onto the constraint set of the vector
+# field (e.g. WGAN clipping) with `_postprocess` after every step.
+
+
+# Solution at the nodes t, with the flow's derivative there for cubic
+# Hermite dense output. y and f have shape (len(t), 2, N), or (len(t), 2)
+# for scalar start points.
+class OdeSolution(object):
+    def __init__(self, vec_fn, t, y, f, nfev=0):
+        self.vec_fn = vec_fn
+        self.t = t
+        self.y = y
+        self.f = f
+        self.nfev = nfev
+
+    @property
+    def trajectory(self):
+        # Node values in the layout of the (batched) GD integrators
+        return Trajectory(self.y)
+
+    def __call__(self, t):
+        # Dense output at times t in [t[0], t[-1]], e.g. the GD iterate times
+        # np.arange(nsteps + 1) * h
+        t = np.asarray(t, dtype=float)
+        ts = self.t
+        i = np.clip(np.searchsorted(ts, t, side='right') - 1, 0, len(ts) - 2)
+        dt = ts[i + 1] - ts[i]
+        s = (t - ts[i]) / dt
+        shape = s.shape + (1,) * (self.y.ndim - 1)
+        s = s.reshape(shape)
+        dt = dt.reshape(shape)
+
+        s2 = s * s
+        s3 = s2 * s
+        y = ((2 * s3 - 3 * s2 + 1) * self.y[i] + (s3 - 2 * s2 + s) * dt * self.f[i]
+             + (3 * s2 - 2 * s3) * self.y[i + 1] + (s3 - s2) * dt * self.f[i + 1])
+
+        q = t.ndim
+        theta, psi = self.vec_fn._postprocess(y.take(0, axis=q), y.take(1, axis=q))
+        return np.stack([theta, psi], axis=q)
+
+    def __repr__(self):
+        return 'OdeSolution(nodes=%d, t_end=%g, nfev=%d)' % (
+            len(self.t), self.t[-1], self.nfev)
+
+
+def solve_rk4(vec_fn, theta0, psi0, nsteps=50, h=0.1, rate_g=1., rate_d=1.):
+    # Classical Runge-Kutta with fixed step h, nodes at t = k * h
+    y, scalar = _start(vec_fn, theta0, psi0)
+    flow = _Flow(vec_fn, rate_g, rate_d, y.shape[1])
+
+    ys = np.empty((nsteps + 1,) + y.shape)
+    fs = np.empty((nsteps + 1,) + y.shape)
+    ys[0] = y
+    fs[0] = flow(y)
+    stage = np.empty_like(y)
+    for k in range(nsteps):
+        k1 = fs[k]
+        k2 = flow(np.add(y, 0.5 * h * k1, out=stage)).copy()
+        k3 = flow(np.add(y, 0.5 * h * k2, out=stage)).copy()
+        k4 = flow(np.add(y, h * k3, out=stage))
+        y = y + h / 6 * (k1 + 2 * (k2 + k3) + k4)
+        y = _project(vec_fn, y)
+        ys[k + 1] = y
+        fs[k + 1] = flow(y)
+
+    t = h * np.arange(nsteps + 1)
+    return _solution(vec_fn, t, ys, fs, flow.nfev, scalar)
+
+
+# Dormand-Prince 5(4) tableau
+_A = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+# 5th minus 4th order weights
+_E = np.array([71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200,
+               22 / 525, -1 / 40])
+
+
+def solve_rk45(vec_fn, theta0, psi0, t_end=5., rtol=1e-6, atol=1e-9, h0=None,
+               h_max=np.inf, rate_g=1., rate_d=1., max_steps=100000):
+    # Adaptive Dormand-Prince with the 4th order embedded error estimate.
+    # The step is accepted when the scaled RMS error of the worst point of
+    # the batch is at most one.
+    y, scalar = _start(vec_fn, theta0, psi0)
+    flow = _Flow(vec_fn, rate_g, rate_d, y.shape[1])
+    project = type(vec_fn)._postprocess is not VectorField._postprocess
+
+    t = 0.
+    f = flow(y).copy()
+    if h0 is None:
+        h0 = _initial_step(y, f, t_end, rtol, atol)
+    h = min(h0, h_max, t_end)
+
+    ts, ys, fs = [t], [y], [f]
+    K = np.empty((7,) + y.shape)
+    while t < t_end:
+        if len(ts) > max_steps:
+            raise RuntimeError('solve_rk45 took more than %d steps' % max_steps)
+        h = min(h, t_end - t)
+        if t + h == t:
+            raise RuntimeError('solve_rk45 step size underflow at t=%g' % t)
+
+        K[0] = f
+        for s in range(1, 7):
+            stage = y + h * np.tensordot(_A[s], K[:s], axes=1)
+            K[s] = flow(stage)
+        y_new = stage
+        err = h * np.tensordot(_E, K, axes=1)
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        with np.errstate(invalid='ignore', over='ignore'):
+            norm = np.max(np.sqrt(np.mean((err / scale) ** 2, axis=0)))
+
+        if not norm <= 1:
+            # rejected; non-finite errors shrink the step the most
+            factor = 0.2 if not np.isfinite(norm) else max(0.2, 0.9 * norm ** -0.2)
+            h *= factor
+            continue
+
+        t += h
+        if project:
+            y = _project(vec_fn, y_new)
+            f = flow(y).copy()
+        else:
+            # first same as last: the 7th stage is the flow at y_new
+            y, f = y_new, K[6].copy()
+        ts.append(t)
+        ys.append(y)
+        fs.append(f)
+        factor = 5. if norm == 0 else min(5., max(0.2, 0.9 * norm ** -0.2))
+        h = min(h * factor, h_max)
+
+    return _solution(vec_fn, np.array(ts), np.array(ys), np.array(fs),
+                     flow.nfev, scalar)
+
+
+def _start(vec_fn, theta0, psi0):
+    # Start points as a (2, N) array, projected like the GD integrators do
+    scalar = np.ndim(theta0) == 0 and np.ndim(psi0) == 0
+    theta0, psi0 = np.broadcast_arrays(
+        np.asarray(theta0, dtype=float), np.asarray(psi0, dtype=float))
+    theta = np.array(theta0, dtype=float).ravel()
+    psi = np.array(psi0, dtype=float).ravel()
+    return _project(vec_fn, np.stack([theta, psi])), scalar
+
+
+def _project(vec_fn, y):
+    theta, psi = vec_fn._postprocess(y[0].copy(), y[1].copy())
+    return np.stack([theta, psi])
+
+
+def _initial_step(y, f, t_end, rtol, atol):
+    scale = atol + rtol * np.abs(y)
+    d0 = np.sqrt(np.mean((y / scale) ** 2))
+    d1 = np.sqrt(np.mean((f / scale) ** 2))
+    if d0 < 1e-5 or d1 < 1e-5:
+        return min(1e-6, t_end)
+    return min(0.01 * d0 / d1, t_end)
+
+
+def _solution(vec_fn, t, ys, fs, nfev, scalar):
+    if scalar:
+        ys, fs = ys[..., 0], fs[..., 0]
+    return OdeSolution(vec_fn, t, ys, fs, nfev)
+
+
+# Right-hand side of the flow on (2, N) arrays, written into one buffer
+class _Flow(object):
+    def __init__(self, vec_fn, rate_g, rate_d, n):
+        self.vec_fn = vec_fn
+        self.rates = np.array([[rate_g], [rate_d]], dtype=float)
+        self.out = np.empty((2, n))
+        self.nfev = 0
+
+    def __call__(self, y):
+        self.nfev += 1
+        theta = np.ascontiguousarray(y[0])
+        psi = np.ascontiguousarray(y[1])
+        self.vec_fn._get_vector(theta, psi, out=(self.out[0], self.out[1]))
+        self.out *= self.rates
+        return self.out
@@ -1,13 +1,20 @@
 import numpy as np
-from matplotlib import pyplot as plt
-import matplotlib.patches as patches
 import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from diracgan import instrument
 from diracgan.gans import WGAN
+from diracgan.basins import STATUS_NAMES
 from diracgan.subplots import vector_field_plot
-from tqdm import tqdm
+from diracgan.decimate import decimate_view
+
+# matplotlib, Pillow and tqdm are imported by the functions that use them,
+# so that importing this module (e.g. in a pool worker) stays cheap
 
 
 def plot_vector(vecfn, theta, psi, outfile, trajectory=None, marker='b^'):
+    from matplotlib import pyplot as plt
     fig, ax = plt.subplots(1, 1)
     theta, psi = np.meshgrid(theta, psi)
     v1, v2 = vecfn(theta, psi)
@@ -20,49 +27,308 @@ def plot_vector(vecfn, theta, psi, outfile, trajectory=None, marker='b^'):
     plt.show()
 
 
-def simulate_trajectories(vecfn, theta, psi, trajectory, outfolder, maxframes=300):
-    if not os.path.exists(outfolder):
-        os.makedirs(outfolder)
-    theta, psi = np.meshgrid(theta, psi)
-    
-    N = min(len(trajectory[0]), maxframes)
+def plot_convergence_map(result, outfile, title=None):
+    # Left: status of every start point of a basins.convergence_map result,
+    # right: steps to convergence where the point converged
+    from matplotlib import pyplot as plt
+    from matplotlib.colors import ListedColormap, BoundaryNorm
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(10, 4.5))
+    # pixels are centred on the start points
+    dx = (result.theta[-1] - result.theta[0]) / max(1, len(result.theta) - 1) / 2
+    dy = (result.psi[-1] - result.psi[0]) / max(1, len(result.psi) - 1) / 2
+    extent = (result.theta[0] - dx, result.theta[-1] + dx,
+              result.psi[0] - dy, result.psi[-1] + dy)
 
-    v1, v2 = vecfn(theta, psi)
-    if isinstance(vecfn, WGAN):
-        clip_y = vecfn.clip
+    colors = ListedColormap(['#a3be8c', '#ebcb8b', '#5e81ac', '#bf616a'])
+    norm = BoundaryNorm(np.arange(-0.5, len(STATUS_NAMES)), colors.N)
+    im = ax1.imshow(result.status, origin='lower', extent=extent,
+                    cmap=colors, norm=norm, interpolation='nearest')
+    cbar = fig.colorbar(im, ax=ax1, ticks=np.arange(len(STATUS_NAMES)))
+    cbar.ax.set_yticklabels(STATUS_NAMES)
+
+    steps = np.ma.masked_where(~result.converged, result.steps)
+    im = ax2.imshow(steps, origin='lower', extent=extent,
+                    interpolation='nearest')
+    fig.colorbar(im, ax=ax2, label='steps to convergence')
+
+    for ax in (ax1, ax2):
+        ax.set_xlabel(r'$\theta_0$')
+        ax.set_ylabel(r'$\psi_0$')
+    if title is not None:
+        fig.suptitle(title)
+    plt.savefig(outfile, bbox_inches='tight')
+    plt.show()
+
+
+def plot_stability_diagram(x, y, spectrum, outfile, xlabel, ylabel, title=None):
+    # Spectral radius of a spectral.Spectrum over the grid of x (last axis)
+    # and y (first axis) values, with the stability boundary radius = 1
+    from matplotlib import pyplot as plt
+    fig, ax = plt.subplots(1, 1)
+    radius = np.minimum(spectrum.radius, 2.)
+    mesh = ax.pcolormesh(x, y, radius, cmap='RdYlGn_r', vmin=0., vmax=2.,
+                         shading='auto')
+    ax.contour(x, y, spectrum.radius, levels=[1.], colors='k')
+    fig.colorbar(mesh, ax=ax, label='spectral radius')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    if title is not None:
+        ax.set_title(title)
+    plt.savefig(outfile, bbox_inches='tight')
+    plt.show()
+
+
+def plot_critical_curve(values, curves, outfile, xlabel):
+    # Critical step sizes of critical.critical_curve, one line per GAN; GD
+    # converges below each line
+    from matplotlib import pyplot as plt
+    fig, ax = plt.subplots(1, 1)
+    for name, hs in curves.items():
+        ax.plot(values, hs, label=name)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(r'critical $h$')
+    ax.set_ylim(bottom=0)
+    ax.legend()
+    plt.savefig(outfile, bbox_inches='tight')
+    plt.show()
+
+
+def plot_comparison(gans, trajectories, theta, psi, outfile, dpi=100):
+    # The GUI's overview without Tk: one panel per GAN in two rows, with the
+    # vector field, the trajectory and its start point
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    n_cols = (len(gans) + 1) // 2
+    fig = Figure(figsize=(2.6 * n_cols, 5.4), layout='constrained')
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(2, n_cols, sharex=True, sharey=True, squeeze=False)
+    X, Y = np.meshgrid(theta, psi)
+    for ax, gan, trajectory in zip(axs.flat, gans, trajectories):
+        v1, v2 = gan(X, Y)
+        ax.quiver(X, Y, v1, v2, color='#3b4252')
+        ax.set_xlim(np.min(theta) - 0.25, np.max(theta) + 0.25)
+        ax.set_ylim(np.min(psi) - 0.25, np.max(psi) + 0.25)
+        data = trajectory.data
+        points = decimate_view(data, ax, per_pixel=2. * dpi / fig.dpi)
+        ax.scatter(points[:, 0], points[:, 1], marker='^', facecolor='None',
+                   edgecolor='#5e81ac', alpha=0.8)
+        ax.scatter(data[:1, 0], data[:1, 1], color='#bf616a')
+        ax.set_title(gan.__class__.__name__)
+        ax.set_aspect('equal')
+    for ax in axs.flat[len(gans):]:
+        ax.set_visible(False)
+    fig.savefig(outfile, dpi=dpi)
+
+
+def simulate_trajectories(vecfn, theta, psi, trajectory, outfile=None, maxframes=300,
+                          workers=None, dpi=None, fps=30, outfolder=None):
+    # Renders the first maxframes steps of a trajectory. An outfile ending in
+    # .gif, .png or .apng becomes one animation, anything else is a folder
+    # that gets one PNG per frame as before. outfolder is the old name of
+    # outfile.
+    #
+    # Frames are split into contiguous chunks over a pool of worker
+    # processes; every worker builds one figure and only moves the artists
+    # that change between frames.
+    if outfolder is not None:
+        if outfile is not None:
+            raise TypeError('simulate_trajectories() got both outfile and outfolder')
+        warnings.warn('simulate_trajectories(outfolder=...) is deprecated, '
+                      'use outfile', DeprecationWarning, stacklevel=2)
+        outfile = outfolder
+    if outfile is None:
+        raise TypeError("simulate_trajectories() missing argument 'outfile'")
+    ext = os.path.splitext(outfile)[1].lower()
+    animate = ext in ('.gif', '.png', '.apng')
+    if dpi is None:
+        dpi = 100 if animate else 200
+    if not animate and not os.path.exists(outfile):
+        os.makedirs(outfile)
+
+    thetas, psis = trajectory
+    N = min(len(thetas), maxframes)
+    if N < 2:
+        return
+    data = np.stack([thetas[:N], psis[:N]], axis=1)
+    args = (vecfn, theta, psi, data, dpi, None if animate else outfile,
+            ext == '.gif')
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, N - 1))
+    # a few chunks per worker keep the pool busy while results stream in order
+    nchunks = min(N - 1, 4 * workers)
+    chunks = np.array_split(np.arange(1, N), nchunks)
+
+    from tqdm import tqdm
+    if workers == 1:
+        _init_renderer(*args)
+        results = map(_render_frames, chunks)
+        executor = None
     else:
-        clip_y = None
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=_init_renderer, initargs=args)
+        futures = [instrument.submit(executor, 'render', _render_frames, chunk)
+                   for chunk in chunks]
+        results = (future.result() for future in futures)
 
-    for i in tqdm(range(1, N)):
-        fig, (ax1, ax2) = plt.subplots(1, 2,
-                                       subplot_kw=dict(adjustable='box', aspect=0.7))
+    progress = tqdm(total=N - 1)
+    try:
+        frames = _frames(results, progress)
+        if animate:
+            _write_animation(frames, outfile, ext, fps)
+        else:
+            for _ in frames:
+                pass
+    finally:
+        progress.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        else:
+            # the figure of the inline renderer is not kept in this process
+            _drop_renderer()
 
-        plt.sca(ax1)
-        trajectory_i = [trajectory[0][:i], trajectory[1][:i]]
-        vector_field_plot(theta, psi, v1, v2, trajectory_i, clip_y=clip_y, marker='b-')
-        plt.plot(trajectory_i[0][-1], trajectory_i[1][-1], 'bo')
 
-        plt.sca(ax2)
-        ax2.set_axisbelow(True)
-        plt.grid()
+def _frames(results, progress):
+    # With instrumentation, the time per frame includes waiting for the
+    # workers and encoding the frame before
+    last = time.perf_counter()
+    for chunk in results:
+        for frame in chunk:
+            progress.update()
+            if instrument.enabled:
+                now = time.perf_counter()
+                instrument.frame('simulate_trajectories', now - last)
+                last = now
+            yield frame
+
+
+def _write_animation(frames, outfile, ext, fps):
+    # Pillow's GIF writer encodes the frames as they arrive from the workers,
+    # its APNG writer needs them all up front
+    first = next(frames)
+    if ext == '.gif':
+        fmt = 'GIF'
+    else:
+        fmt = 'PNG'
+        frames = list(frames)
+    first.save(outfile, format=fmt, save_all=True, append_images=frames,
+               duration=1000. / fps, loop=0)
+
+
+# Per-process renderer. The pool initializer only keeps its arguments, it
+# is built by the first job so that instrumentation counts its work.
+_renderer = None
+_renderer_args = None
+
+
+def _init_renderer(*args):
+    global _renderer, _renderer_args
+    _renderer = None
+    _renderer_args = args
+
 
-        x = np.linspace(np.min(theta), np.max(theta))
-        y = x*trajectory[1][i]
-        plt.plot(x, y, 'C1')
+def _drop_renderer():
+    global _renderer, _renderer_args
+    _renderer = None
+    _renderer_args = None
 
-        ax2.add_patch(patches.Rectangle(
-                (-0.05, 0), .1, 2.5, facecolor='C2'
-        ))
 
-        ax2.add_patch(patches.Rectangle(
-                (trajectory[0][i]-0.05, 0), .1, 2.5, facecolor='C0'
-        ))
+def _render_frames(indices):
+    global _renderer
+    if _renderer is None:
+        _renderer = FrameRenderer(*_renderer_args)
+    return [_renderer.render(i) for i in indices]
 
-        plt.xlim(np.min(theta), np.max(theta))
-        plt.ylim(-1, 3.)
-        plt.xlabel(r'$\theta$')
-        plt.xticks(np.linspace(np.min(theta), np.max(theta), 5))
+
+class FrameRenderer(object):
+    # Two-panel frame of simulate_trajectories: the vector field with the
+    # trajectory so far, and the generator/data distributions with the
+    # discriminator at step i. Static parts are drawn once; each frame
+    # restores them and redraws only the animated artists.
+    def __init__(self, vecfn, theta, psi, data, dpi, outfolder=None, quantize=False):
+        import matplotlib.patches as patches
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from PIL import Image
+        self.data = data
+        self.dpi = dpi
+        self.outfolder = outfolder
+        self.quantize = quantize
+
+        theta, psi = np.meshgrid(theta, psi)
+        v1, v2 = vecfn(theta, psi)
+        if isinstance(vecfn, WGAN):
+            clip_y = vecfn.clip
+        else:
+            clip_y = None
+        self.x = np.linspace(np.min(theta), np.max(theta))
+
+        self.fig = Figure()
+        self.canvas = FigureCanvasAgg(self.fig)
+        ax1, ax2 = self.fig.subplots(1, 2, subplot_kw=dict(adjustable='box', aspect=0.7))
+
+        vector_field_plot(theta, psi, v1, v2, clip_y=clip_y, ax=ax1)
+        ax1.plot(data[0, 0], data[0, 1], 'ro')
+        self.path, = ax1.plot([], [], 'b-', markerfacecolor='None', animated=True)
+        self.head, = ax1.plot([], [], 'bo', animated=True)
+
+        ax2.set_axisbelow(True)
+        ax2.grid()
+        self.line, = ax2.plot(self.x, 0 * self.x, 'C1', animated=True)
+        ax2.add_patch(patches.Rectangle((-0.05, 0), .1, 2.5, facecolor='C2'))
+        self.disc = ax2.add_patch(patches.Rectangle(
+                (0, 0), .1, 2.5, facecolor='C0', animated=True))
+        ax2.set_xlim(np.min(theta), np.max(theta))
+        ax2.set_ylim(-1, 3.)
+        ax2.set_xlabel(r'$\theta$')
+        ax2.set_xticks(np.linspace(np.min(theta), np.max(theta), 5))
         ax2.set_yticklabels([])
+        self.axes = (ax1, ax2)
+
+        self.fig.set_dpi(dpi)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        # pixel box of bbox_inches='tight', the same for every frame
+        bbox = self.fig.get_tightbbox(self.canvas.get_renderer()).padded(0.1)
+        height = self.fig.bbox.height
+        self.crop = (int(np.floor(bbox.x0 * dpi)), int(np.floor(height - bbox.y1 * dpi)),
+                     int(np.ceil(bbox.x1 * dpi)), int(np.ceil(height - bbox.y0 * dpi)))
+
+        if quantize:
+            # GIF frames share the palette of the last frame, mapping onto a
+            # fixed palette is much cheaper than quantizing every frame
+            self.palette = self.draw(len(data) - 1).quantize(
+                method=Image.Quantize.FASTOCTREE)
+
+    def render(self, i):
+        from PIL import Image
+        image = self.draw(i)
+        if self.outfolder is not None:
+            image.save(os.path.join(self.outfolder, '%06d.png' % i))
+            return None
+        if self.quantize:
+            image = image.quantize(palette=self.palette, dither=Image.Dither.NONE)
+        return image
+
+    def draw(self, i):
+        from PIL import Image
+        data = self.data
+        path = decimate_view(data[:i], self.axes[0], method='minmax',
+                             markers=False)
+        self.path.set_data(path[:, 0], path[:, 1])
+        self.head.set_data(data[i - 1:i, 0], data[i - 1:i, 1])
+        self.line.set_ydata(self.x * data[i, 1])
+        self.disc.set_x(data[i, 0] - 0.05)
+
+        self.canvas.restore_region(self.background)
+        ax1, ax2 = self.axes
+        ax1.draw_artist(self.path)
+        ax1.draw_artist(self.head)
+        ax2.draw_artist(self.line)
+        ax2.draw_artist(self.disc)
 
-        plt.savefig(os.path.join(outfolder, '%06d.png' % i), dpi=200, bbox_inches='tight')
-        plt.close()
+        image = Image.frombuffer('RGBA', self.canvas.get_width_height(),
+                                 self.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+        return image.crop(self.crop).convert('RGB')
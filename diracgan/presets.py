@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from diracgan import instrument
+from diracgan.gans import (
+    GAN,
+    NSGAN,
+    WGAN,
+    WGAN_GP,
+    GAN_Consensus,
+    GAN_GradPenalty,
+    GAN_InstNoise,
+    NSGAN_GradPenalty,
+)
+from diracgan.simulate import trajectory_gd
+
+
+# The ten GANs compared by dirac_gui.py and `python -m diracgan run`, with
+# the GUI's default parameters
+DEFAULT_PARAMS = {
+    "WGAN_clip": 1.0,
+    "WGAN_GP_reg": 0.7,
+    "WGAN_GP_target": 1.0,
+    "GAN_InstNoise_std": 0.7,
+    "GAN_GradPenalty_reg": 0.3,
+    "GAN_Consensus_reg": 1.0,
+    "NSGAN_GradPenalty_reg": 0.3,
+    "LeCamGAN_lambda": -0.3,
+    "LeCamGAN_alpha": 0.1,
+}
+
+# Simulation settings of the GUI's sliders
+DEFAULT_RUN = {
+    "theta0": 1.0,
+    "psi0": 1.0,
+    "h_g": 0.2,
+    "h_d": 0.2,
+    "n_steps": 500,
+    "gsteps": 1,
+    "dsteps": 1,
+    "scheme": "simultaneous",
+}
+
+
+def make_gans(params=None):
+    # Missing entries of params take their default
+    p = dict(DEFAULT_PARAMS)
+    if params is not None:
+        p.update(params)
+    # new_gans lives next to the package, not in it
+    from new_gans import LSGAN, LeCamGAN
+
+    return [
+        GAN(),
+        NSGAN(),
+        WGAN(p["WGAN_clip"]),
+        WGAN_GP(p["WGAN_GP_reg"], p["WGAN_GP_target"]),
+        GAN_InstNoise(p["GAN_InstNoise_std"], method="quadrature"),
+        GAN_GradPenalty(p["GAN_GradPenalty_reg"]),
+        GAN_Consensus(p["GAN_Consensus_reg"]),
+        NSGAN_GradPenalty(p["NSGAN_GradPenalty_reg"]),
+        LSGAN(),
+        LeCamGAN(p["LeCamGAN_lambda"], p["LeCamGAN_alpha"]),
+    ]
+
+
+def simulate_gans(gans, run=None, workers=None):
+    # Trajectories of all GANs for the settings in run (see DEFAULT_RUN),
+    # one worker process per GAN
+    r = dict(DEFAULT_RUN)
+    if run is not None:
+        r.update(run)
+    args = (r["theta0"], r["psi0"], r["n_steps"], r["h_g"], r["h_d"],
+            r["scheme"], r["gsteps"], r["dsteps"])
+    if workers is None:
+        workers = min(len(gans), os.cpu_count() or 1)
+    if workers == 1:
+        trajectories = []
+        for gan in gans:
+            with instrument.stage("integration"):
+                trajectories.append(_simulate(gan, *args))
+        return trajectories
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [instrument.submit(executor, "integration", _simulate, gan, *args)
+                   for gan in gans]
+        return [future.result() for future in futures]
+
+
+def _simulate(gan, theta0, psi0, nsteps, h_g, h_d, scheme, gsteps, dsteps):
+    return trajectory_gd(gan, float(theta0), float(psi0), nsteps=int(nsteps),
+                         hs_g=float(h_g), hs_d=float(h_d), scheme=scheme,
+                         gsteps=int(gsteps), dsteps=int(dsteps))
@@ -1,42 +1,245 @@
+import math
+import numpy as np
+from diracgan.trajectory import Trajectory
 
 
 # Simulate
+#
+# The integrators take optional stopping criteria: `tol` stops once
+# |(theta, psi)| < tol, `step_tol` once a step moves less than step_tol and
+# `max_norm` once |(theta, psi)| reaches max_norm or becomes non-finite
+# (max_norm=np.inf stops on overflow and NaN only). Trajectories end at the
+# step that met a criterion and record why in `stop_reason`, one of
+# STOP_REASONS, and that step in `stop_step`.
+MAX_STEPS, CONVERGED, STALLED, DIVERGED = STOP_REASONS = (
+    'max_steps', 'converged', 'stalled', 'diverged')
+
+
 def trajectory_simgd(vec_fn, theta0, psi0,
-                     nsteps=50, hs_g=0.1, hs_d=0.1):
-    theta, psi = vec_fn.postprocess(theta0, psi0)
-    thetas, psis = [theta], [psi]
-
-    if isinstance(hs_g, float):
-        hs_g = [hs_g] * nsteps
-    if isinstance(hs_d, float):
-        hs_d = [hs_d] * nsteps
-    assert(len(hs_g) == nsteps)
-    assert(len(hs_d) == nsteps)
-
-    for h_g, h_d in zip(hs_g, hs_d):
+                     nsteps=50, hs_g=0.1, hs_d=0.1, dtype=np.float64,
+                     tol=None, step_tol=None, max_norm=None):
+    trajectory = _start(vec_fn, theta0, psi0, dtype)
+    return _run_simgd(vec_fn, trajectory, nsteps, hs_g, hs_d,
+                      _stop_test(tol, step_tol, max_norm))
+
+
+def trajectory_altgd(vec_fn, theta0, psi0,
+                     nsteps=50, hs_g=0.1, hs_d=0.1, gsteps=1, dsteps=1,
+                     dtype=np.float64, tol=None, step_tol=None, max_norm=None):
+    trajectory = _start(vec_fn, theta0, psi0, dtype)
+    return _run_altgd(vec_fn, trajectory, nsteps, hs_g, hs_d, gsteps, dsteps,
+                      _stop_test(tol, step_tol, max_norm))
+
+
+SCHEMES = ('simultaneous', 'alternating')
+
+
+def trajectory_gd(vec_fn, theta0, psi0, nsteps=50, hs_g=0.1, hs_d=0.1,
+                  scheme='simultaneous', gsteps=1, dsteps=1, resume=None,
+                  tol=None, step_tol=None, max_norm=None):
+    # With `resume`, a shorter trajectory of the same configuration, only
+    # the steps missing up to nsteps are simulated
+    if resume is not None:
+        return extend_trajectory(vec_fn, resume, nsteps - resume.nsteps,
+                                 hs_g=hs_g, hs_d=hs_d, scheme=scheme,
+                                 gsteps=gsteps, dsteps=dsteps, tol=tol,
+                                 step_tol=step_tol, max_norm=max_norm)
+    if scheme == 'simultaneous':
+        return trajectory_simgd(vec_fn, theta0, psi0,
+                                nsteps=nsteps, hs_g=hs_g, hs_d=hs_d, tol=tol,
+                                step_tol=step_tol, max_norm=max_norm)
+    elif scheme == 'alternating':
+        return trajectory_altgd(vec_fn, theta0, psi0,
+                                nsteps=nsteps, hs_g=hs_g, hs_d=hs_d,
+                                gsteps=gsteps, dsteps=dsteps, tol=tol,
+                                step_tol=step_tol, max_norm=max_norm)
+    raise ValueError('Unknown scheme %r' % (scheme,))
+
+
+def extend_trajectory(vec_fn, trajectory, nsteps=50, hs_g=0.1, hs_d=0.1,
+                      scheme='simultaneous', gsteps=1, dsteps=1,
+                      tol=None, step_tol=None, max_norm=None):
+    # Continues a trajectory returned by the integrators above in place, as
+    # if it had been simulated with the additional nsteps from the start
+    stop = _stop_test(tol, step_tol, max_norm)
+    if scheme == 'simultaneous':
+        return _run_simgd(vec_fn, trajectory, nsteps, hs_g, hs_d, stop)
+    elif scheme == 'alternating':
+        return _run_altgd(vec_fn, trajectory, nsteps, hs_g, hs_d,
+                          gsteps, dsteps, stop)
+    raise ValueError('Unknown scheme %r' % (scheme,))
+
+
+# Streaming simulation
+#
+# A TrajectoryStream runs trajectory_gd on demand: `take(n)` simulates the
+# next n steps and returns their iterates as an (n, 2) array, fewer once the
+# stream has ended, and iterating over the stream yields such chunks of
+# chunk_size steps until it ends. It ends after nsteps steps (never when
+# nsteps is None) or when a stopping criterion is met, see `stop_reason`.
+# Only the last `history` iterates are kept (`recent()`), so a stream runs
+# for any number of steps in bounded memory. Its results are identical to
+# those of trajectory_gd.
+class TrajectoryStream(object):
+    def __init__(self, vec_fn, theta0, psi0, hs_g=0.1, hs_d=0.1,
+                 scheme='simultaneous', gsteps=1, dsteps=1, nsteps=None,
+                 chunk_size=64, history=1000, dtype=np.float64,
+                 tol=None, step_tol=None, max_norm=None):
+        if scheme not in SCHEMES:
+            raise ValueError('Unknown scheme %r' % (scheme,))
+        self.vec_fn = vec_fn
+        self.hs_g = float(hs_g)
+        self.hs_d = float(hs_d)
+        self.scheme = scheme
+        self.gsteps = gsteps
+        self.dsteps = dsteps
+        self.nsteps = nsteps
+        self.chunk_size = chunk_size
+        self.criteria = dict(tol=tol, step_tol=step_tol, max_norm=max_norm)
+        # index of the last iterate and why the stream ended, None until then
+        self.step = 0
+        self.stop_reason = MAX_STEPS if nsteps == 0 else None
+
+        self._trajectory = _start(vec_fn, theta0, psi0, dtype)
+        self._recent = np.empty((history, 2), dtype=dtype)
+        self._head = 0
+        self._count = 0
+        self._push(self._trajectory.data)
+
+    def take(self, n):
+        if self.nsteps is not None:
+            n = min(n, self.nsteps - self.step)
+        if self.stop_reason is not None or n <= 0:
+            return self._recent[:0].copy()
+
+        trajectory = extend_trajectory(
+            self.vec_fn, self._trajectory, n, hs_g=self.hs_g, hs_d=self.hs_d,
+            scheme=self.scheme, gsteps=self.gsteps, dsteps=self.dsteps,
+            **self.criteria)
+        rows = trajectory.data[1:].copy()
+        # the last iterate and the end state are all it takes to continue
+        self._trajectory = Trajectory(trajectory.data[-1:].copy(),
+                                      trajectory.end, trajectory.state)
+        self.step += len(rows)
+        if trajectory.stop_reason != MAX_STEPS:
+            self.stop_reason = trajectory.stop_reason
+        elif self.nsteps is not None and self.step == self.nsteps:
+            self.stop_reason = MAX_STEPS
+        self._push(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.take(self.chunk_size)
+            if len(rows):
+                yield rows
+            if self.stop_reason is not None:
+                return
+
+    def recent(self):
+        # The last min(history, step + 1) iterates, oldest first
+        if self._count < len(self._recent):
+            return self._recent[:self._count].copy()
+        return np.roll(self._recent, -self._head, axis=0)
+
+    def _push(self, rows):
+        # Appends to the ring buffer of recent iterates
+        size = len(self._recent)
+        rows = rows[-size:]
+        n = len(rows)
+        first = min(n, size - self._head)
+        self._recent[self._head:self._head + first] = rows[:first]
+        self._recent[:n - first] = rows[first:]
+        self._head = (self._head + n) % size
+        self._count = min(self._count + n, size)
+
+
+def _start(vec_fn, theta0, psi0, dtype):
+    theta, psi = vec_fn.postprocess(float(theta0), float(psi0))
+    trajectory = Trajectory.empty(0, dtype=dtype)
+    trajectory.data[0] = theta, psi
+    trajectory.end = theta, psi
+    return trajectory
+
+
+def _step_sizes(hs, nsteps):
+    if isinstance(hs, float):
+        hs = [hs] * nsteps
+    assert(len(hs) == nsteps)
+    return hs
+
+
+def _resume(vec_fn, trajectory, nsteps):
+    # End state of the trajectory and the rows to fill, starting with the
+    # current last point
+    if trajectory.end is None:
+        raise ValueError('Trajectory has no end state to resume from')
+    if trajectory.state is not None:
+        vec_fn.set_state(trajectory.state)
+    theta, psi = trajectory.end
+    return theta, psi, trajectory.grow(nsteps)
+
+
+def _finish(vec_fn, trajectory, theta, psi, k, nsteps, reason):
+    # k of nsteps new steps were taken
+    if k < nsteps:
+        trajectory.data = trajectory.data[:len(trajectory.data) - nsteps + k]
+    trajectory.end = theta, psi
+    trajectory.state = vec_fn.get_state()
+    trajectory.stop_reason = reason
+    trajectory.stop_step = trajectory.nsteps
+    return trajectory
+
+
+def _stop_test(tol, step_tol, max_norm):
+    # Scalar stopping test for the criteria given, None if there are none
+    if tol is None and step_tol is None and max_norm is None:
+        return None
+
+    def stop(theta, psi, theta_prev, psi_prev):
+        r = math.hypot(theta, psi)
+        if max_norm is not None and not r < max_norm:
+            return DIVERGED
+        if tol is not None and r < tol:
+            return CONVERGED
+        if step_tol is not None and \
+                math.hypot(theta - theta_prev, psi - psi_prev) < step_tol:
+            return STALLED
+        return None
+    return stop
+
+
+def _run_simgd(vec_fn, trajectory, nsteps, hs_g, hs_d, stop=None):
+    hs_g = _step_sizes(hs_g, nsteps)
+    hs_d = _step_sizes(hs_d, nsteps)
+    theta, psi, out = _resume(vec_fn, trajectory, nsteps)
+
+    k, reason = 0, MAX_STEPS
+    for k, (h_g, h_d) in enumerate(zip(hs_g, hs_d), 1):
+        theta_prev, psi_prev = theta, psi
         v1, v2 = vec_fn(theta, psi)
         theta += h_g * v1
         psi += h_d * v2
         theta, psi = vec_fn.postprocess(theta, psi)
-        thetas.append(theta)
-        psis.append(psi)
+        out[k, 0], out[k, 1] = theta, psi
+        if stop is not None:
+            stopped = stop(theta, psi, theta_prev, psi_prev)
+            if stopped is not None:
+                reason = stopped
+                break
 
-    return thetas, psis
+    return _finish(vec_fn, trajectory, theta, psi, k, nsteps, reason)
 
 
-def trajectory_altgd(vec_fn, theta0, psi0,
-                     nsteps=50, hs_g=0.1, hs_d=0.1, gsteps=1, dsteps=1):
-    theta, psi = vec_fn.postprocess(theta0, psi0)
-    thetas, psis = [theta], [psi]
-
-    if isinstance(hs_g, float):
-        hs_g = [hs_g] * nsteps
-    if isinstance(hs_d, float):
-        hs_d = [hs_d] * nsteps
-    assert(len(hs_g) == nsteps)
-    assert(len(hs_d) == nsteps)
-
-    for h_g, h_d in zip(hs_g, hs_d):
+def _run_altgd(vec_fn, trajectory, nsteps, hs_g, hs_d, gsteps, dsteps,
+               stop=None):
+    hs_g = _step_sizes(hs_g, nsteps)
+    hs_d = _step_sizes(hs_d, nsteps)
+    theta, psi, out = _resume(vec_fn, trajectory, nsteps)
+
+    k, reason = 0, MAX_STEPS
+    for k, (h_g, h_d) in enumerate(zip(hs_g, hs_d), 1):
+        theta_prev, psi_prev = theta, psi
         for it in range(gsteps):
             v1, v2 = vec_fn(theta, psi)
             theta += h_g * v1
@@ -46,7 +249,139 @@ def trajectory_altgd(vec_fn, theta0, psi0,
             v1, v2 = vec_fn(theta, psi)
             psi += h_d * v2
             theta, psi = vec_fn.postprocess(theta, psi)
-        thetas.append(theta)
-        psis.append(psi)
+        out[k, 0], out[k, 1] = theta, psi
+        if stop is not None:
+            stopped = stop(theta, psi, theta_prev, psi_prev)
+            if stopped is not None:
+                reason = stopped
+                break
+
+    return _finish(vec_fn, trajectory, theta, psi, k, nsteps, reason)
+
+
+# Batched simulation
+def _batch_step_sizes(hs, nsteps, n):
+    # Scalar, per-point (n,) or per-step and per-point (nsteps, n) step sizes
+    hs = np.asarray(hs, dtype=float)
+    if hs.ndim == 1:
+        hs = hs[None, :]
+    return np.broadcast_to(hs, (nsteps, n))
+
+
+def _batch_start(vec_fn, theta0, psi0):
+    theta0, psi0 = np.broadcast_arrays(
+        np.asarray(theta0, dtype=float), np.asarray(psi0, dtype=float)
+    )
+    theta = np.array(theta0, dtype=float).ravel()
+    psi = np.array(psi0, dtype=float).ravel()
+    return vec_fn._postprocess(theta, psi)
+
+
+def _simgd_step(vec_fn, theta, psi, h_g, h_d, buf):
+    # One simultaneous step on arrays; buf holds two arrays of theta's size
+    v1, v2 = vec_fn._get_vector(theta, psi, out=buf)
+    theta += np.multiply(h_g, v1, out=v1)
+    psi += np.multiply(h_d, v2, out=v2)
+    return vec_fn._postprocess(theta, psi)
+
+
+def _altgd_step(vec_fn, theta, psi, h_g, h_d, gsteps, dsteps, buf):
+    for it in range(gsteps):
+        v1, v2 = vec_fn._get_vector(theta, psi, out=buf)
+        theta += np.multiply(h_g, v1, out=v1)
+        theta, psi = vec_fn._postprocess(theta, psi)
+
+    for it in range(dsteps):
+        v1, v2 = vec_fn._get_vector(theta, psi, out=buf)
+        psi += np.multiply(h_d, v2, out=v2)
+        theta, psi = vec_fn._postprocess(theta, psi)
+    return theta, psi
+
+
+def trajectory_simgd_batch(vec_fn, theta0, psi0,
+                           nsteps=50, hs_g=0.1, hs_d=0.1, dtype=np.float64,
+                           tol=None, step_tol=None, max_norm=None):
+    def step(theta, psi, h_g, h_d, buf):
+        return _simgd_step(vec_fn, theta, psi, h_g, h_d, buf)
+    return _run_batch(vec_fn, step, theta0, psi0, nsteps, hs_g, hs_d, dtype,
+                      tol, step_tol, max_norm)
+
+
+def trajectory_altgd_batch(vec_fn, theta0, psi0,
+                           nsteps=50, hs_g=0.1, hs_d=0.1, gsteps=1, dsteps=1,
+                           dtype=np.float64, tol=None, step_tol=None,
+                           max_norm=None):
+    def step(theta, psi, h_g, h_d, buf):
+        return _altgd_step(vec_fn, theta, psi, h_g, h_d, gsteps, dsteps, buf)
+    return _run_batch(vec_fn, step, theta0, psi0, nsteps, hs_g, hs_d, dtype,
+                      tol, step_tol, max_norm)
+
+
+def _run_batch(vec_fn, step, theta0, psi0, nsteps, hs_g, hs_d, dtype,
+               tol, step_tol, max_norm):
+    # Points that meet a stopping criterion are dropped from the batch and
+    # keep their last value in the remaining rows; the trajectory ends once
+    # no point is left. stop_reason holds a code per point.
+    theta, psi = _batch_start(vec_fn, theta0, psi0)
+    n = theta.size
+    hs_g = _batch_step_sizes(hs_g, nsteps, n)
+    hs_d = _batch_step_sizes(hs_d, nsteps, n)
+
+    trajectory = Trajectory.empty(nsteps, batch=n, dtype=dtype)
+    thetas, psis = trajectory
+    thetas[0], psis[0] = theta, psi
+    reasons = np.zeros(n, dtype=np.int8)
+    stop_steps = np.full(n, nsteps)
+    check = tol is not None or step_tol is not None or max_norm is not None
+
+    # idx is None while every point is still running
+    idx = None
+    theta_all, psi_all = theta.copy(), psi.copy()
+    buf = np.empty(n), np.empty(n)
+    for k in range(nsteps):
+        if idx is None:
+            h_g, h_d, work = hs_g[k], hs_d[k], buf
+        else:
+            m = len(idx)
+            h_g, h_d = hs_g[k][idx], hs_d[k][idx]
+            work = buf[0][:m], buf[1][:m]
+        if step_tol is not None:
+            theta_prev, psi_prev = theta.copy(), psi.copy()
+        theta, psi = step(theta, psi, h_g, h_d, work)
+
+        if idx is None:
+            thetas[k + 1], psis[k + 1] = theta, psi
+        else:
+            theta_all[idx], psi_all[idx] = theta, psi
+            thetas[k + 1], psis[k + 1] = theta_all, psi_all
+        if not check:
+            continue
+
+        r = np.hypot(theta, psi)
+        reason = np.zeros(r.shape, dtype=np.int8)
+        if step_tol is not None:
+            moved = np.hypot(theta - theta_prev, psi - psi_prev)
+            reason[moved < step_tol] = STOP_REASONS.index(STALLED)
+        if tol is not None:
+            reason[r < tol] = STOP_REASONS.index(CONVERGED)
+        if max_norm is not None:
+            reason[~(r < max_norm)] = STOP_REASONS.index(DIVERGED)
+        done = reason > 0
+        if not done.any():
+            continue
+
+        if idx is None:
+            idx = np.arange(n)
+            theta_all, psi_all = theta.copy(), psi.copy()
+        reasons[idx[done]] = reason[done]
+        stop_steps[idx[done]] = k + 1
+        keep = ~done
+        idx = idx[keep]
+        theta, psi = theta[keep], psi[keep]
+        if len(idx) == 0:
+            trajectory.data = trajectory.data[:k + 2]
+            break
 
-    return thetas, psis
+    trajectory.stop_reason = reasons
+    trajectory.stop_step = stop_steps
+    return trajectory
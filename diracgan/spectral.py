@@ -0,0 +1,109 @@
+import numpy as np
+
+
+# Local convergence at the Nash equilibrium (0, 0): GD converges from close
+# enough start points iff the spectral radius of the Jacobian of its update
+# map is below one, and the flow iff the field's Jacobian has eigenvalues
+# with negative real part.
+#
+# Everything here works on stacks of 2x2 matrices of shape (..., 2, 2) and
+# broadcasts step sizes against array-valued GAN parameters, e.g.
+#
+#     J = jacobian(GAN_Consensus(reg=np.linspace(0, 2, 200)[:, None]))
+#     res = gd_spectrum(J, hs_g=np.linspace(0.01, 2, 300), hs_d=...)
+#
+# gives the stability diagram over (reg, h) as arrays of shape (200, 300).
+
+
+def jacobian(vec_fn, theta=0., psi=0., eps=1e-6):
+    # The closed form of the field at (0, 0) when it has one, central
+    # differences otherwise (and away from (0, 0))
+    if theta == 0. and psi == 0.:
+        J = vec_fn.nash_jacobian()
+        if J is not None:
+            return J
+    return jacobian_fd(vec_fn, theta, psi, eps)
+
+
+def jacobian_fd(vec_fn, theta=0., psi=0., eps=1e-6):
+    # Central differences from one batched evaluation at the four points
+    # (theta +- eps, psi) and (theta, psi +- eps); theta and psi may be
+    # arrays of points
+    theta, psi = np.broadcast_arrays(np.asarray(theta, dtype=float),
+                                     np.asarray(psi, dtype=float))
+    offsets = np.array([[eps, -eps, 0., 0.], [0., 0., eps, -eps]])
+    offsets = offsets.reshape((2, 4) + (1,) * theta.ndim)
+    v1, v2 = vec_fn._get_vector(np.ascontiguousarray(theta + offsets[0]),
+                                np.ascontiguousarray(psi + offsets[1]))
+    d_theta = np.stack([v1[0] - v1[1], v2[0] - v2[1]], axis=-1) / (2 * eps)
+    d_psi = np.stack([v1[2] - v1[3], v2[2] - v2[3]], axis=-1) / (2 * eps)
+    return np.stack([d_theta, d_psi], axis=-1)
+
+
+def update_matrix(J, hs_g=0.1, hs_d=0.1, scheme='simultaneous', gsteps=1,
+                  dsteps=1):
+    # Jacobian of one step of simulate.trajectory_gd at the equilibrium:
+    # I + diag(h_g, h_d) J when simultaneous, and gsteps generator updates
+    # followed by dsteps discriminator updates when alternating
+    J = np.asarray(J, dtype=float)
+    h_g = np.asarray(hs_g, dtype=float)[..., None, None]
+    h_d = np.asarray(hs_d, dtype=float)[..., None, None]
+    # the generator's and the discriminator's rows of J
+    J_g = J * [[1.], [0.]]
+    J_d = J * [[0.], [1.]]
+    I = np.eye(2)
+
+    if scheme == 'simultaneous':
+        return I + h_g * J_g + h_d * J_d
+    elif scheme == 'alternating':
+        A_g = np.linalg.matrix_power(I + h_g * J_g, gsteps)
+        A_d = np.linalg.matrix_power(I + h_d * J_d, dsteps)
+        return np.matmul(A_d, A_g)
+    raise ValueError('Unknown scheme %r' % (scheme,))
+
+
+def eigenvalues(M):
+    # Both eigenvalues of 2x2 matrices from trace and determinant, shape
+    # (..., 2), the larger modulus first
+    M = np.asarray(M, dtype=float)
+    half_trace = (M[..., 0, 0] + M[..., 1, 1]) / 2
+    det = M[..., 0, 0] * M[..., 1, 1] - M[..., 0, 1] * M[..., 1, 0]
+    root = np.sqrt((half_trace**2 - det).astype(complex))
+    lam = np.stack([half_trace + root, half_trace - root], axis=-1)
+    order = np.argsort(-np.abs(lam), axis=-1, kind='stable')
+    return np.take_along_axis(lam, order, axis=-1)
+
+
+# Spectrum of a GD update map. `radius` is the spectral radius, `rate` the
+# asymptotic rate -log(radius) at which the distance to the equilibrium
+# shrinks per step (negative when diverging) and `stable` where radius < 1;
+# radii within rtol of one (e.g. alternating GD on the plain GAN, which
+# cycles) count as not stable.
+class Spectrum(object):
+    def __init__(self, matrix, rtol=1e-9):
+        self.matrix = matrix
+        self.eigenvalues = eigenvalues(matrix)
+        self.radius = np.abs(self.eigenvalues[..., 0])
+        with np.errstate(divide='ignore'):
+            self.rate = -np.log(self.radius)
+        self.stable = self.radius < 1 - rtol
+
+    def __repr__(self):
+        return 'Spectrum(shape=%s, stable=%.3f)' % (
+            self.radius.shape, np.mean(self.stable))
+
+
+def gd_spectrum(J, hs_g=0.1, hs_d=0.1, scheme='simultaneous', gsteps=1,
+                dsteps=1):
+    return Spectrum(update_matrix(J, hs_g, hs_d, scheme, gsteps, dsteps))
+
+
+def flow_stable(J):
+    # Where the continuous dynamics are locally asymptotically stable
+    return np.real(eigenvalues(J)).max(axis=-1) < 0
+
+
+def stability(vec_fn, hs_g=0.1, hs_d=0.1, scheme='simultaneous', gsteps=1,
+              dsteps=1):
+    # Spectrum of GD with the given step sizes at the equilibrium of vec_fn
+    return gd_spectrum(jacobian(vec_fn), hs_g, hs_d, scheme, gsteps, dsteps)
@@ -1,28 +1,36 @@
 import numpy as np
-from matplotlib import pyplot as plt
+from diracgan.decimate import decimate_view
 
 
 def arrow_plot(x, y, color='C1'):
+    from matplotlib import pyplot as plt
     plt.quiver(x[:-1], y[:-1], x[1:]-x[:-1], y[1:]-y[:-1],
                color=color, scale_units='xy', angles='xy', scale=1)
 
 
-def vector_field_plot(theta, psi, v1, v2, trajectory=None, clip_y=None, marker='b^'):
-    plt.quiver(theta, psi, v1, v2)
+def vector_field_plot(theta, psi, v1, v2, trajectory=None, clip_y=None, marker='b^',
+                      ax=None):
+    # Draws into the current pyplot axes unless an Axes is given
+    if ax is None:
+        from matplotlib import pyplot as plt
+        ax = plt.gca()
+    ax.quiver(theta, psi, v1, v2)
     if clip_y is not None:
-        plt.axhspan(np.min(psi), -clip_y, facecolor='0.2', alpha=0.5)
-        plt.plot([np.min(theta), np.max(theta)], [-clip_y, -clip_y], 'k-')
-        plt.axhspan(clip_y, np.max(psi), facecolor='0.2', alpha=0.5)
-        plt.plot([np.min(theta), np.max(theta)], [clip_y, clip_y], 'k-')
+        ax.axhspan(np.min(psi), -clip_y, facecolor='0.2', alpha=0.5)
+        ax.plot([np.min(theta), np.max(theta)], [-clip_y, -clip_y], 'k-')
+        ax.axhspan(clip_y, np.max(psi), facecolor='0.2', alpha=0.5)
+        ax.plot([np.min(theta), np.max(theta)], [clip_y, clip_y], 'k-')
+
+    ax.set_xlim(np.min(theta), np.max(theta))
+    ax.set_ylim(np.min(psi), np.max(psi))
+    ax.set_xlabel(r'$\theta$')
+    ax.set_ylabel(r'$\psi$')
+    ax.set_xticks(np.linspace(np.min(theta), np.max(theta), 5))
+    ax.set_yticks(np.linspace(np.min(psi), np.max(psi), 5))
 
     if trajectory is not None:
+        # long trajectories are reduced to what the axes can show
         psis, thetas = trajectory
-        plt.plot(psis, thetas, marker, markerfacecolor='None')
-        plt.plot(psis[0], thetas[0], 'ro')
-
-    plt.xlim(np.min(theta), np.max(theta))
-    plt.ylim(np.min(psi), np.max(psi))
-    plt.xlabel(r'$\theta$')
-    plt.ylabel(r'$\psi$')
-    plt.xticks(np.linspace(np.min(theta), np.max(theta), 5))
-    plt.yticks(np.linspace(np.min(psi), np.max(psi), 5))
+        points = decimate_view(np.stack([psis, thetas], axis=1), ax)
+        ax.plot(points[:, 0], points[:, 1], marker, markerfacecolor='None')
+        ax.plot(psis[0], thetas[0], 'ro')
@@ -0,0 +1,357 @@
+import argparse
+import inspect
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from diracgan import gans, instrument
+from diracgan.simulate import trajectory_gd
+
+
+# Per-run settings a sweep config may set next to the GAN parameters
+RUN_PARAMS = {
+    'theta0': 1.0,
+    'psi0': 1.0,
+    'hs_g': 0.1,
+    'hs_d': 0.1,
+    'scheme': 'simultaneous',
+    'gsteps': 1,
+    'dsteps': 1,
+}
+
+METRICS = ('final_distance', 'convergence_step', 'oscillation', 'min_distance')
+
+
+def gan_class(name):
+    # VectorField classes by name, from diracgan.gans or the top-level
+    # new_gans module when it is importable
+    cls = getattr(gans, name, None)
+    if cls is None:
+        try:
+            import new_gans
+        except ImportError:
+            new_gans = None
+        cls = getattr(new_gans, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, gans.VectorField)):
+        raise ValueError('Unknown GAN %r' % (name,))
+    return cls
+
+
+def gan_params(name):
+    signature = inspect.signature(gan_class(name).__init__)
+    return [p for p in signature.parameters if p != 'self']
+
+
+def make_gan(config):
+    params = gan_params(config['gan'])
+    return gan_class(config['gan'])(
+        **{k: v for k, v in config.items() if k in params})
+
+
+def expand_grid(grid):
+    # Expands {'gan': names, param: values, ...} (or a list of such dicts)
+    # into a list of configs. Every GAN is combined only with the parameters
+    # its constructor takes, so one grid can cover several GANs.
+    if isinstance(grid, (list, tuple)):
+        return [config for g in grid for config in expand_grid(g)]
+
+    grid = dict(grid)
+    names = grid.pop('gan')
+    if isinstance(names, str):
+        names = [names]
+    grid = {k: v if isinstance(v, (list, tuple, np.ndarray)) else [v]
+            for k, v in grid.items()}
+
+    configs = []
+    used = set()
+    for name in names:
+        params = gan_params(name)
+        keys = [k for k in grid if k in params or k in RUN_PARAMS]
+        used.update(keys)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            values = dict(zip(keys, values))
+            config = {'gan': name}
+            config.update((k, _plain(values[k])) for k in params if k in values)
+            config.update((k, _run_value(k, values.get(k, default)))
+                          for k, default in RUN_PARAMS.items())
+            configs.append(config)
+
+    unused = set(grid) - used
+    if unused:
+        raise ValueError('Parameters %s are not taken by any of %s'
+                         % (sorted(unused), names))
+    return configs
+
+
+def _plain(value):
+    # numpy scalars as JSON-serialisable Python values
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _run_value(name, value):
+    # Step counts are loop counts, also when given as 1.0 by a linspace
+    value = _plain(value)
+    if isinstance(RUN_PARAMS[name], int):
+        if not float(value).is_integer():
+            raise ValueError('%s must be an integer, got %r' % (name, value))
+        value = int(value)
+    return value
+
+
+# On-disk results of a sweep in one directory:
+#   index.json         configs, the settings of run_sweep and metric names
+#   done.npy           (n,) bool, which configs have been run
+#   metrics.npy        (n, len(METRICS)) float64
+#   trajectories.npy   (n, nsteps+1, 2) float64, optional
+# The .npy files are memory-mapped and written as shards finish, so an
+# interrupted sweep keeps everything finished so far.
+class SweepStore(object):
+    def __init__(self, path, mode='r+'):
+        self.path = path
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        self.configs = index['configs']
+        self.nsteps = index['nsteps']
+        # stores of older versions do not record these
+        self.tol = index.get('tol')
+        self.max_norm = index.get('max_norm')
+        self.metric_names = tuple(index['metrics'])
+        self.done = open_memmap(self._file('done'), mode=mode)
+        self.metrics = open_memmap(self._file('metrics'), mode=mode)
+        if index['trajectories']:
+            self.trajectories = open_memmap(self._file('trajectories'), mode=mode)
+        else:
+            self.trajectories = None
+
+    @classmethod
+    def create(cls, path, configs, nsteps, trajectories=True, tol=1e-3,
+               max_norm=None):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        n = len(configs)
+        index = {'nsteps': nsteps, 'tol': tol, 'max_norm': max_norm,
+                 'metrics': list(METRICS), 'trajectories': trajectories,
+                 'configs': configs}
+        open_memmap(os.path.join(path, 'done.npy'), mode='w+',
+                    dtype=bool, shape=(n,)).flush()
+        metrics = open_memmap(os.path.join(path, 'metrics.npy'), mode='w+',
+                              dtype=np.float64, shape=(n, len(METRICS)))
+        metrics[:] = np.nan
+        metrics.flush()
+        if trajectories:
+            open_memmap(os.path.join(path, 'trajectories.npy'), mode='w+',
+                        dtype=np.float64, shape=(n, nsteps + 1, 2)).flush()
+        # the index is written last, a store without one is incomplete
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            json.dump(index, f, indent=1)
+        return cls(path)
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def __len__(self):
+        return len(self.configs)
+
+    def pending(self):
+        return np.flatnonzero(~self.done)
+
+    def metric(self, name):
+        return self.metrics[:, self.metric_names.index(name)]
+
+    def write(self, indices, metrics, trajectories=None):
+        self.metrics[indices] = metrics
+        if self.trajectories is not None and trajectories is not None:
+            self.trajectories[indices] = trajectories
+            self.trajectories.flush()
+        self.metrics.flush()
+        # done is flushed after the data it marks
+        self.done[indices] = True
+        self.done.flush()
+
+    def table(self, sort='final_distance', top=None):
+        # Rows of (config, metrics) for finished configs, best first
+        done = np.flatnonzero(self.done)
+        order = done[np.argsort(self.metric(sort)[done], kind='stable')]
+        if top is not None:
+            order = order[:top]
+        return [(self.configs[i], dict(zip(self.metric_names, self.metrics[i])))
+                for i in order]
+
+
+def summarize(data, tol=1e-3):
+    # Metrics of one (nsteps+1, 2) trajectory, see METRICS
+    r = np.hypot(data[:, 0], data[:, 1])
+    converged = np.flatnonzero(r < tol)
+    step = converged[0] if len(converged) else np.nan
+    # half the peak-to-peak of theta and psi over the last tenth of the run
+    tail = data[-max(2, len(data) // 10):]
+    oscillation = np.max(np.ptp(tail, axis=0)) / 2
+    return r[-1], step, oscillation, np.min(r)
+
+
+def _run_shard(items, nsteps, tol, trajectories, max_norm=None):
+    indices = []
+    metrics = np.empty((len(items), len(METRICS)))
+    datas = np.empty((len(items), nsteps + 1, 2)) if trajectories else None
+    with np.errstate(all='ignore'):
+        for j, (i, config) in enumerate(items):
+            trajectory = trajectory_gd(
+                make_gan(config), config['theta0'], config['psi0'],
+                nsteps=nsteps, hs_g=float(config['hs_g']),
+                hs_d=float(config['hs_d']), scheme=config['scheme'],
+                gsteps=config['gsteps'], dsteps=config['dsteps'],
+                max_norm=max_norm)
+            indices.append(i)
+            metrics[j] = summarize(trajectory.data, tol)
+            if trajectories:
+                # runs stopped early keep their last value
+                datas[j, :trajectory.nsteps + 1] = trajectory.data
+                datas[j, trajectory.nsteps + 1:] = trajectory.data[-1]
+    return indices, metrics, datas
+
+
+def run_sweep(grid, path, nsteps=500, tol=1e-3, workers=None, shard_size=64,
+              trajectories=True, progress=None, max_norm=None):
+    # Runs every config of the grid (see expand_grid) and stores the results
+    # in path. Running it again on the same path with the same grid and
+    # settings resumes the configs not finished yet, anything else is
+    # refused. Runs leaving the max_norm ball are stopped there (see
+    # simulate).
+    configs = expand_grid(grid)
+    if os.path.exists(os.path.join(path, 'index.json')):
+        store = SweepStore(path)
+        different = [name for name, stored, given in (
+            ('grid', store.configs, json.loads(json.dumps(configs))),
+            ('nsteps', store.nsteps, nsteps),
+            ('tol', store.tol, tol),
+            ('max_norm', store.max_norm, max_norm),
+            ('trajectories', store.trajectories is not None, trajectories),
+        ) if stored != given]
+        if different:
+            raise ValueError('%s holds a different sweep, %s differ'
+                             % (path, ', '.join(different)))
+    else:
+        store = SweepStore.create(path, configs, nsteps, trajectories, tol,
+                                  max_norm)
+
+    pending = store.pending()
+    shards = [[(int(i), configs[i]) for i in pending[k:k + shard_size]]
+              for k in range(0, len(pending), shard_size)]
+
+    if workers == 1:
+        for shard in shards:
+            with instrument.stage('sweep'):
+                result = _run_shard(shard, nsteps, tol, trajectories, max_norm)
+            store.write(*result)
+            if progress is not None:
+                progress(len(shard))
+        return store
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [instrument.submit(executor, 'sweep', _run_shard, shard,
+                                     nsteps, tol, trajectories, max_norm)
+                   for shard in shards]
+        try:
+            for future in as_completed(futures):
+                indices, metrics, datas = future.result()
+                store.write(indices, metrics, datas)
+                if progress is not None:
+                    progress(len(indices))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return store
+
+
+def parse_values(text):
+    # "a,b,c" lists values, "start:stop:num" is np.linspace(start, stop, num)
+    if text.count(':') == 2:
+        start, stop, num = text.split(':')
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [_parse_value(v) for v in text.split(',')]
+
+
+def _parse_value(text):
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return text
+
+
+def format_table(rows, metric_names=METRICS):
+    keys = []
+    for config, _ in rows:
+        keys += [k for k in config if k not in keys]
+    header = keys + list(metric_names)
+    lines = [header]
+    for config, metrics in rows:
+        lines.append([_format(config.get(k, '')) for k in keys]
+                     + [_format(metrics[m]) for m in metric_names])
+    widths = [max(len(line[c]) for line in lines) for c in range(len(header))]
+    return '\n'.join('  '.join(v.rjust(w) for v, w in zip(line, widths))
+                     for line in lines)
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '%.4g' % value
+    return str(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m diracgan.sweep',
+        description='Run a grid of DiracGAN configurations and store the results.')
+    parser.add_argument('path', help='directory of the result store')
+    parser.add_argument('--gan', action='append', required=True,
+                        help='VectorField class name, may be repeated')
+    parser.add_argument('--grid', action='append', default=[],
+                        metavar='NAME=VALUES',
+                        help='parameter values as a,b,c or start:stop:num')
+    parser.add_argument('--nsteps', type=int, default=500)
+    parser.add_argument('--tol', type=float, default=1e-3)
+    parser.add_argument('--max-norm', type=float, default=None,
+                        help='stop runs once |(theta, psi)| reaches this')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--shard-size', type=int, default=64)
+    parser.add_argument('--no-trajectories', action='store_true',
+                        help='store the metrics only')
+    parser.add_argument('--sort', default='final_distance', choices=METRICS)
+    parser.add_argument('--top', type=int, default=20,
+                        help='number of configs in the summary')
+    args = parser.parse_args(argv)
+
+    grid = {'gan': args.gan}
+    for item in args.grid:
+        name, _, values = item.partition('=')
+        grid[name] = parse_values(values)
+
+    total = len(expand_grid(grid))
+    finished = [0]
+
+    def progress(n):
+        finished[0] += n
+        sys.stderr.write('\r%d/%d configs' % (finished[0], total))
+        sys.stderr.flush()
+
+    store = run_sweep(grid, args.path, nsteps=args.nsteps, tol=args.tol,
+                      workers=args.workers, shard_size=args.shard_size,
+                      trajectories=not args.no_trajectories, progress=progress,
+                      max_norm=args.max_norm)
+    sys.stderr.write('\n')
+    print(format_table(store.table(sort=args.sort, top=args.top),
+                       store.metric_names))
+
+
+if __name__ == '__main__':
+    main()
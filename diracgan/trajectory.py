@@ -0,0 +1,94 @@
+import numpy as np
+
+
+# Iterates of a simulation in one contiguous array: `data` has shape
+# (nsteps+1, 2) for a single trajectory and (nsteps+1, 2, N) for N
+# trajectories simulated together. Column 0 holds theta, column 1 psi.
+#
+# Trajectories from the scalar integrators also keep their full-precision
+# end point and the VectorField state (e.g. its RNG) at that point, which is
+# what simulate.extend_trajectory resumes from.
+#
+# `stop_reason` and `stop_step` tell why and at which step the integrator
+# stopped (see simulate.STOP_REASONS); batched trajectories hold one code
+# per point, an index into STOP_REASONS.
+#
+# Integer indexing, iteration and np.asarray() behave like the
+# (thetas, psis) tuple the integrators used to return: t[0] is the thetas,
+# `thetas, psis = t` unpacks. len(t) and slices count iterates, like the
+# old lists did: len(t) is nsteps+1 and t[a:b] a Trajectory of iterates a
+# to b. Single iterates are rows of `data`.
+class Trajectory(object):
+    def __init__(self, data, end=None, state=None, stop_reason=None,
+                 stop_step=None):
+        self.data = data
+        self.end = end
+        self.state = state
+        self.stop_reason = stop_reason
+        self.stop_step = stop_step
+        self._buffer = data
+
+    @classmethod
+    def empty(cls, nsteps, batch=None, dtype=np.float64):
+        if batch is None:
+            shape = (nsteps + 1, 2)
+        else:
+            shape = (nsteps + 1, 2, batch)
+        return cls(np.empty(shape, dtype=dtype))
+
+    @property
+    def thetas(self):
+        return self.data[:, 0]
+
+    @property
+    def psis(self):
+        return self.data[:, 1]
+
+    @property
+    def nsteps(self):
+        return len(self.data) - 1
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    def grow(self, nsteps):
+        # Makes room for nsteps more iterates, doubling the underlying buffer
+        # when it is full, and returns the rows from the current last point on
+        n = len(self.data)
+        if n + nsteps > len(self._buffer):
+            capacity = max(n + nsteps, 2 * len(self._buffer))
+            buffer = np.empty((capacity,) + self.data.shape[1:],
+                              dtype=self.data.dtype)
+            buffer[:n] = self.data
+            self._buffer = buffer
+        self.data = self._buffer[:n + nsteps]
+        return self.data[n - 1:]
+
+    def __getstate__(self):
+        # Pickles only the filled part, e.g. to send it to a worker process
+        return {'data': self.data, 'end': self.end, 'state': self.state,
+                'stop_reason': self.stop_reason, 'stop_step': self.stop_step}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        yield self.thetas
+        yield self.psis
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return Trajectory(self.data[idx])
+        return (self.thetas, self.psis)[idx]
+
+    def __array__(self, dtype=None, copy=None):
+        # (2, nsteps+1) like np.asarray((thetas, psis)), a view if possible
+        return np.array(np.moveaxis(self.data, 1, 0), dtype=dtype, copy=copy)
+
+    def __repr__(self):
+        return 'Trajectory(nsteps=%d, shape=%s, dtype=%s)' % (
+            self.nsteps, self.data.shape, self.data.dtype)
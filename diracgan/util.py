@@ -1,10 +1,49 @@
+import math
 import numpy as np
 
-def sigmoid(x):
-    m = np.minimum(0, x)
-    return np.exp(m)/(np.exp(m) + np.exp(-x + m))
+
+def logistic_parts(x, e=None, r=None):
+    # e = exp(-|x|) and r = 1/(1 + e). sigmoid(x) is r for x >= 0 and e*r
+    # otherwise, so one exp that cannot overflow covers both sides.
+    if e is None:
+        e = np.empty(np.shape(x))
+    if r is None:
+        r = np.empty(np.shape(x))
+    np.abs(x, out=e)
+    np.negative(e, out=e)
+    np.exp(e, out=e)
+    np.add(e, 1., out=r)
+    np.divide(1., r, out=r)
+    return e, r
+
+
+def sigmoid(x, out=None, work=None, negate=False):
+    # sigmoid(x), or sigmoid(-x) with negate=True. `work` is scratch space
+    # for exp(-|x|) and may alias x.
+    tail = np.greater(x, 0) if negate else np.less(x, 0)
+    e, r = logistic_parts(x, e=work, r=out)
+    np.multiply(e, r, out=r, where=tail)
+    if r.ndim == 0:
+        return r[()]
+    return r
 
 
 def clip(x, clipval=0.3):
     x = np.clip(x, -clipval, clipval)
     return x
+
+
+def logistic_parts_scalar(x):
+    e = math.exp(-abs(x))
+    return e, 1./(1. + e)
+
+
+def sigmoid_scalar(x):
+    e, r = logistic_parts_scalar(x)
+    if x < 0:
+        return e*r
+    return r
+
+
+def clip_scalar(x, clipval=0.3):
+    return min(max(x, -clipval), clipval)
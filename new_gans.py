@@ -1,4 +1,4 @@
-from diracgan.gans import VectorField, fp, fp2
+from diracgan.gans import VectorField, GAN, fp, fp2, fp_scalar, _jacobian, _outputs
 import numpy as np
 
 def f(x):
@@ -10,19 +10,51 @@ class LeCamGAN(VectorField):
         self.reg = reg
         self.anchor_real = anchor_real
 
-    def _get_vector(self, theta, psi):
-        v1 = (-psi * fp(psi*theta)) + self.reg * ((2 * (psi ** 2) * theta -2 * psi * self.anchor_real))
-        
-        v2 = theta * fp(psi * theta)
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+        z = np.multiply(psi, theta, out=v2)
+        fz = fp(z, out=v1, work=z)
+        np.multiply(theta, fz, out=v2)
+        np.multiply(psi, fz, out=v1)
+
+        # reg * (2*psi**2*theta - 2*psi*anchor_real)
+        reg = np.multiply(psi, theta, out=np.empty(np.shape(v1)))
+        np.subtract(reg, self.anchor_real, out=reg)
+        np.multiply(reg, psi, out=reg)
+        np.multiply(reg, 2 * self.reg, out=reg)
+        np.subtract(reg, v1, out=v1)
         return v1, v2
 
+    def _get_vector_scalar(self, theta, psi):
+        f = fp_scalar(psi*theta)
+        v1 = (-psi * f) + self.reg * ((2 * (psi*psi) * theta - 2 * psi * self.anchor_real))
+        v2 = theta * f
+        return v1, v2
+
+    def nash_jacobian(self):
+        reg = np.asarray(self.reg, dtype=float)
+        return _jacobian(0., -0.5 - 2 * reg * self.anchor_real, 0.5, 0.)
+
 
 class LSGAN(VectorField):
-    def _get_vector(self, theta, psi):
-        v1 = ((psi * (theta**2)) - theta)
-        v2 = -1 * (psi**2) * theta
+    def _get_vector(self, theta, psi, out=None):
+        v1, v2 = _outputs(theta, psi, out)
+        np.multiply(theta, theta, out=v1)
+        np.multiply(psi, v1, out=v1)
+        np.subtract(v1, theta, out=v1)
+        np.multiply(psi, psi, out=v2)
+        np.multiply(v2, theta, out=v2)
+        np.negative(v2, out=v2)
+        return v1, v2
+
+    def _get_vector_scalar(self, theta, psi):
+        v1 = ((psi * (theta*theta)) - theta)
+        v2 = -1 * (psi*psi) * theta
         return v1, v2
 
+    def nash_jacobian(self):
+        return _jacobian(-1., 0., 0., 0.)
+
 
 
 
@@ -31,10 +63,15 @@ class LeCam_GAN(VectorField):
         super().__init__()
 
 
-    def _get_vector(self, theta, psi):
-        v1 = -psi * fp(psi*theta)
-        v2 = theta * fp(psi*theta)
-        return v1, v2
+    def _get_vector(self, theta, psi, out=None):
+        return GAN._get_vector(self, theta, psi, out)
+
+    def _get_vector_scalar(self, theta, psi):
+        f = fp_scalar(psi*theta)
+        return -psi * f, theta * f
+
+    def nash_jacobian(self):
+        return GAN.nash_jacobian(self)
 
 
 
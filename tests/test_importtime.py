@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from benchmarks.importtime import BUDGETS, measure
+
+# Import times depend on the machine and its load, so the budgets are only
+# checked on request, e.g. DIRACGAN_IMPORTTIME_SCALE=1.5 for 1.5x the budgets
+SCALE = os.environ.get('DIRACGAN_IMPORTTIME_SCALE')
+
+
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_no_forbidden_imports(module):
+    budget, forbidden = BUDGETS[module]
+    ms, packages = measure(module, repeat=1)
+    assert sorted(packages.intersection(forbidden)) == []
+
+
+@pytest.mark.skipif(not SCALE, reason='set DIRACGAN_IMPORTTIME_SCALE to '
+                    'check the import time budgets')
+@pytest.mark.parametrize('module', list(BUDGETS))
+def test_import_time_budget(module):
+    budget, forbidden = BUDGETS[module]
+    ms, packages = measure(module)
+    assert ms <= budget * float(SCALE)
@@ -0,0 +1,28 @@
+import numpy as np
+
+from diracgan.cache import TrajectoryCache
+from diracgan.gans import GAN_InstNoise
+from diracgan.simulate import extend_trajectory, trajectory_gd
+
+
+def crn_gan():
+    return GAN_InstNoise(0.7, method='mc', nsamples=50, seed=3,
+                         common_random_numbers=True)
+
+
+def test_resumed_crn_run_matches_uninterrupted():
+    full = trajectory_gd(crn_gan(), 1., 1., nsteps=100, hs_g=0.1, hs_d=0.1)
+    half = trajectory_gd(crn_gan(), 1., 1., nsteps=50, hs_g=0.1, hs_d=0.1)
+    # a fresh instance only has the state stored with the trajectory
+    resumed = extend_trajectory(crn_gan(), half, 50, hs_g=0.1, hs_d=0.1)
+    np.testing.assert_array_equal(resumed.data, full.data)
+
+
+def test_cached_crn_extension_matches_uninterrupted():
+    full = trajectory_gd(crn_gan(), 1., 1., nsteps=100, hs_g=0.1, hs_d=0.1)
+    cache = TrajectoryCache()
+    cache.trajectory(crn_gan(), 1., 1., nsteps=50, hs_g=0.1, hs_d=0.1)
+    extended = cache.trajectory(crn_gan(), 1., 1., nsteps=100, hs_g=0.1,
+                                hs_d=0.1)
+    assert cache.extensions == 1
+    np.testing.assert_array_equal(extended.data, full.data)
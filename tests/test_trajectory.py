@@ -0,0 +1,24 @@
+import numpy as np
+
+from diracgan.gans import GAN
+from diracgan.simulate import trajectory_gd
+
+
+def test_unpacks_like_thetas_psis_tuple():
+    trajectory = trajectory_gd(GAN(), 1., 1., nsteps=20, hs_g=0.1, hs_d=0.1)
+    thetas, psis = trajectory
+    assert len(trajectory) == len(thetas) == 21
+    np.testing.assert_array_equal(trajectory[0], thetas)
+    np.testing.assert_array_equal(trajectory[1], psis)
+    np.testing.assert_array_equal(trajectory[-1], psis)
+    np.testing.assert_array_equal(np.asarray(trajectory), [thetas, psis])
+    assert np.shares_memory(np.asarray(trajectory), trajectory.data)
+
+
+def test_slices_are_iterates():
+    trajectory = trajectory_gd(GAN(), 1., 1., nsteps=20, hs_g=0.1, hs_d=0.1)
+    head = trajectory[:5]
+    assert len(head) == 5 and head.nsteps == 4
+    np.testing.assert_array_equal(head[0], trajectory.thetas[:5])
+    np.testing.assert_array_equal(head.data[2], [trajectory.thetas[2],
+                                                 trajectory.psis[2]])